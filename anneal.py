@@ -0,0 +1,242 @@
+import json
+import math
+import sys
+import time
+import numpy as np
+
+import problems
+import scoring
+import statefile
+import validation
+
+HARD_WEIGHT = 1e9
+
+
+class Annealer:
+    def __init__(self, problem: problems.Problem, vertices, seed=0, penalty=None, pinned=()):
+        self.problem = problem
+        self.rng = np.random.default_rng(seed)
+        self.vertices = np.array(vertices, dtype=np.int64)
+        self.pinned = np.zeros(len(self.vertices), dtype=bool)
+        self.pinned[list(pinned)] = True
+        self.movable = np.flatnonzero(~self.pinned)
+        problem.use_visibility()
+        self.adjacent = problem.adjacency()
+        self.min_lengths, self.max_lengths = problem.min_lengths, problem.max_lengths
+        if penalty is None:
+            penalty = int((np.ptp(problem.hole, axis=0) ** 2).sum())
+        self.penalty = penalty
+
+        self.edge_violation = np.array([self.violation(e, self.vertices[v1], self.vertices[v2])
+                                        for e, (v1, v2) in enumerate(problem.edges)], dtype=np.float64)
+        self.bad_count = int((self.edge_violation > 0).sum())
+        self.weight = 1.0
+
+        d = problem.hole[:, None, :] - self.vertices[None, :, :]
+        d = (d * d).sum(axis=-1)
+        self.nearest_vertex = d.argmin(axis=1)
+        self.nearest = d[np.arange(len(problem.hole)), self.nearest_vertex]
+        self.dislikes = int(self.nearest.sum())
+
+        # hole vertices each figure vertex is currently nearest to, and the hole sorted by x:
+        # a moved vertex can only beat hole vertices within sqrt(nearest_bound) of it along x
+        self.owned = [set() for _ in range(len(self.vertices))]
+        for h, u in enumerate(self.nearest_vertex):
+            self.owned[u].add(h)
+        self.hole_order = np.argsort(problem.hole[:, 0], kind='stable')
+        self.hole_xs = problem.hole[self.hole_order, 0]
+        self.nearest_bound = int(self.nearest.max())
+        self.accepted = 0
+
+    def violation(self, edge_order, p, q):
+        # relative overshoot of the epsilon bound, plus one if the segment leaves the hole
+        d = p - q
+        length = d @ d
+        overshoot = max(self.min_lengths[edge_order] - length, length - self.max_lengths[edge_order], 0)
+        result = float(overshoot / self.problem.original_lengths[edge_order])
+        if not self.problem.segment_inside(p, q):
+            result += 1.0
+        return result
+
+    def energy(self):
+        return self.dislikes + self.weight * self.penalty * self.edge_violation.sum()
+
+    def evaluate_move(self, v, pt):
+        # cost: degree of v segment checks, an x-window of the hole, and a rescan of hole vertices v loses
+        edge_changes = []
+        violation_delta = 0.0
+        bad_delta = 0
+        for u, edge_order in self.adjacent[v]:
+            violation = self.violation(edge_order, pt, self.vertices[u])
+            old_violation = float(self.edge_violation[edge_order])
+            if violation != old_violation:
+                edge_changes.append((edge_order, violation))
+                violation_delta += violation - old_violation
+                bad_delta += int(violation > 0) - int(old_violation > 0)
+
+        # a hole vertex can only change if v owned it or pt lands strictly inside its nearest distance
+        r = math.isqrt(self.nearest_bound)
+        lo, hi = np.searchsorted(self.hole_xs, (pt[0] - r, pt[0] + r + 1))
+        window = self.hole_order[lo:hi]
+        d = self.problem.hole[window] - pt
+        d = (d * d).sum(axis=1)
+        closer = d < self.nearest[window]
+        beaten, beaten_d = window[closer], d[closer]
+
+        lost = np.array(sorted(self.owned[v].difference(beaten.tolist())), dtype=np.int64)
+        lost_d = np.empty(0, dtype=np.int64)
+        lost_vertex = np.empty(0, dtype=np.int64)
+        if len(lost):
+            others = self.problem.hole[lost, None, :] - self.vertices[None, :, :]
+            others = (others * others).sum(axis=-1)
+            moved = self.problem.hole[lost] - pt
+            others[:, v] = (moved * moved).sum(axis=1)
+            lost_vertex = others.argmin(axis=1)
+            lost_d = others[np.arange(len(lost)), lost_vertex]
+
+        changed = np.concatenate((beaten, lost))
+        changed_d = np.concatenate((beaten_d, lost_d))
+        changed_vertex = np.concatenate((np.full(len(beaten), v, dtype=np.int64), lost_vertex))
+        dislikes = self.dislikes + int(changed_d.sum() - self.nearest[changed].sum())
+        delta = dislikes - self.dislikes + self.weight * self.penalty * violation_delta
+        return delta, (v, pt, edge_changes, bad_delta, changed, changed_d, changed_vertex, dislikes)
+
+    def apply_move(self, move):
+        v, pt, edge_changes, bad_delta, changed, changed_d, changed_vertex, dislikes = move
+        self.vertices[v] = pt
+        for edge_order, violation in edge_changes:
+            self.edge_violation[edge_order] = violation
+        self.bad_count += bad_delta
+        for h, u in zip(changed.tolist(), changed_vertex.tolist()):
+            self.owned[self.nearest_vertex[h]].discard(h)
+            self.owned[u].add(h)
+        self.nearest[changed] = changed_d
+        self.nearest_vertex[changed] = changed_vertex
+        self.dislikes = dislikes
+
+        # the bound only has to stay an upper bound; tighten it once every len(hole) accepted moves
+        self.accepted += 1
+        if self.accepted % len(self.nearest) == 0:
+            self.nearest_bound = int(self.nearest.max())
+        elif len(changed_d):
+            self.nearest_bound = max(self.nearest_bound, int(changed_d.max()))
+
+    def propose_jump(self, v):
+        # a random position keeping every edge at v within its length bounds
+        neighbours = self.adjacent[v]
+        if not neighbours:
+            return None
+        u, edge_order = neighbours[int(self.rng.integers(len(neighbours)))]
+        candidates = self.problem.neighbour_candidates(edge_order, self.vertices[u])
+        for w, other_edge in neighbours:
+            d = candidates - self.vertices[w]
+            d = (d * d).sum(axis=1)
+            candidates = candidates[(d >= self.min_lengths[other_edge]) & (d <= self.max_lengths[other_edge])]
+        if not len(candidates):
+            return None
+        return v, candidates[int(self.rng.integers(len(candidates)))]
+
+    def propose(self, temperature_ratio):
+        if not len(self.movable):
+            return None
+        if self.bad_count and self.rng.random() > temperature_ratio:
+            # late in the schedule, spend moves on repairing broken edges
+            bad_edges = np.flatnonzero(self.edge_violation > 0)
+            v = int(self.problem.edges[bad_edges[int(self.rng.integers(len(bad_edges)))]][self.rng.integers(2)])
+            return None if self.pinned[v] else self.propose_jump(v)
+        v = int(self.movable[self.rng.integers(len(self.movable))])
+        if self.rng.random() < 0.5:
+            return self.propose_jump(v)
+        radius = max(1, int(round(temperature_ratio * 8)))
+        pt = self.vertices[v] + self.rng.integers(-radius, radius + 1, size=2)
+        if (pt == self.vertices[v]).all() or not self.problem.inside(pt):
+            return None
+        return v, pt
+
+    def run(self, time_limit, t_start=None, t_end=1.0, hard=False, on_best=None):
+        # soft runs let edges break early and ramp the penalty up; hard runs never accept a violation.
+        # on_best(vertices, dislikes) is called on every new best valid pose
+        if t_start is None:
+            t_start = max(10.0, self.dislikes / max(1, len(self.problem.hole)))
+        best_vertices = self.vertices.copy() if self.bad_count == 0 else None
+        best_dislikes = self.dislikes if self.bad_count == 0 else None
+
+        started = time.monotonic()
+        while True:
+            progress = (time.monotonic() - started) / time_limit
+            if progress >= 1:
+                break
+            temperature = t_start * (t_end / t_start) ** progress
+            self.weight = HARD_WEIGHT if hard else 0.01 * 1e8 ** progress
+            for _ in range(100):
+                proposal = self.propose(1 - progress)
+                if proposal is None:
+                    continue
+                delta, move = self.evaluate_move(*proposal)
+                if delta <= 0 or self.rng.random() < math.exp(-delta / temperature):
+                    self.apply_move(move)
+                    if self.bad_count == 0 and (best_dislikes is None or self.dislikes < best_dislikes):
+                        best_vertices, best_dislikes = self.vertices.copy(), self.dislikes
+                        if on_best is not None:
+                            on_best(best_vertices, best_dislikes)
+        return best_vertices, best_dislikes
+
+
+def read_start_pose(path):
+    if path.endswith('.state'):
+        return statefile.read_state_file(path)
+    with open(path, 'r') as f:
+        return np.array(json.load(f)['vertices'], dtype=np.int64)
+
+
+def improve(problem, start, time_limit, seed=0, pinned=(), on_best=None):
+    start_is_valid = validation.pose_is_valid(problem, start)
+    best_vertices, best_dislikes = (start, scoring.dislikes(problem, start)) if start_is_valid else (None, None)
+
+    def report(vertices, dislikes):
+        if on_best is not None and (best_dislikes is None or dislikes < best_dislikes):
+            on_best(vertices, dislikes)
+
+    vertices, dislikes = Annealer(problem, start, seed=seed, pinned=pinned).run(time_limit / 2, on_best=report)
+    if vertices is not None and (best_dislikes is None or dislikes < best_dislikes):
+        best_vertices, best_dislikes = vertices, dislikes
+
+    # finish with a hard run from the best valid pose so far, which only ever improves it
+    hard_start = best_vertices if best_vertices is not None else start
+    vertices, dislikes = Annealer(problem, hard_start, seed=seed + 1, pinned=pinned).run(
+        time_limit / 2, hard=True, on_best=report)
+    if vertices is not None and (best_dislikes is None or dislikes < best_dislikes):
+        best_vertices, best_dislikes = vertices, dislikes
+
+    return best_vertices, best_dislikes
+
+
+def anneal(num_problem, time_limit, start_path=None, seed=0):
+    p = problems.read_problem(num_problem)
+    if start_path is None:
+        start = problems.read_solution(num_problem)
+        if start is None:
+            return None, None
+    else:
+        start = read_start_pose(start_path)
+
+    vertices, dislikes = improve(p, start, time_limit, seed)
+    if vertices is None:
+        return None, None
+    problems.save_solution(num_problem, vertices, problem=p)
+    return vertices, dislikes
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("not enough args")
+        sys.exit(1)
+
+    num = int(sys.argv[1])
+    time_limit = float(sys.argv[2])
+    start_path = sys.argv[3] if len(sys.argv) > 3 else None
+    _, dislikes = anneal(num, time_limit, start_path)
+    if dislikes is None:
+        print("no valid pose found")
+        sys.exit(1)
+    print("dislikes: {}".format(dislikes))
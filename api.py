@@ -1,17 +1,31 @@
 #!/usr/bin/env python3
 
-import json
+import random
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import requests
-import os
+from requests.adapters import HTTPAdapter
+
+import problems
+import store
 
 POSES = 'https://poses.live'
 
+DEFAULT_RATE = 5.0
+DEFAULT_WORKERS = 8
+RETRIES = 5
+BACKOFF = 0.5
+TIMEOUT = 30
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
 
 def read_token():
     with open("./token", 'r') as f:
         token = f.readline()
-    return token
+    return token.strip()
 
 
 def header_auth(token):
@@ -21,68 +35,142 @@ def header_auth(token):
     }
 
 
-def hello(token):
-    r = requests.get(
-        POSES + '/api/hello',
-        headers=header_auth(token)
-    )
-    return r.json()
-
-
-def post_solution(token, num_problem):
-    SOLUTIONS_PATH = './solutions'
-    filename = '{}.solution'.format(num_problem)
-    filepath = '{}/{}'.format(SOLUTIONS_PATH, filename)
-    with open(filepath, 'r') as f:
-        solution = json.load(f)
-
-    r = requests.post(
-        POSES + '/api/problems/{}/solutions'.format(num_problem),
-        headers=header_auth(token),
-        json=solution
-    )
-    return r.json()
-
+class RateLimiter:
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class Client:
+    def __init__(self, token, base_url=POSES, rate=DEFAULT_RATE, workers=DEFAULT_WORKERS,
+                 retries=RETRIES, backoff=BACKOFF, timeout=TIMEOUT):
+        self.base_url = base_url.rstrip('/')
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.limiter = RateLimiter(rate)
+
+        # one keep-alive pool shared by all worker threads
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update(header_auth(token))
+
+    def close(self):
+        self.session.close()
+
+    def request(self, method, path, **kwargs):
+        for attempt in range(self.retries + 1):
+            self.limiter.wait()
+            try:
+                r = self.session.request(method, self.base_url + path, timeout=self.timeout, **kwargs)
+                if r.status_code not in RETRY_STATUSES:
+                    try:
+                        return r.json()
+                    except ValueError:
+                        return {'error': 'HTTP {}: non-JSON reply'.format(r.status_code)}
+                error = {'error': 'HTTP {}'.format(r.status_code)}
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = {'error': str(e)}
+            except requests.RequestException as e:
+                return {'error': str(e)}
+            if attempt < self.retries:
+                time.sleep(self.backoff * 2 ** attempt * (1 + random.random()))
+        return error
+
+    def hello(self):
+        return self.request('GET', '/api/hello')
+
+    def post_pose(self, num_problem, vertices):
+        return self.request('POST', '/api/problems/{}/solutions'.format(num_problem), json={'vertices': vertices})
+
+    def check_pose(self, num_problem, pose_id):
+        return self.request('GET', '/api/problems/{}/solutions/{}'.format(num_problem, pose_id))
+
+    def map(self, fn, items):
+        with ThreadPoolExecutor(self.workers) as pool:
+            return list(pool.map(fn, items))
+
+    def post_solutions(self, nums, force=False):
+        # store access stays on this thread; worker threads only talk HTTP
+        s = store.open_store()
+        replies = {}
+        todo = []
+        for num_problem in nums:
+            best = s.best(num_problem)
+            if best is None:
+                replies[num_problem] = {'error': 'no valid solution stored'}
+                continue
+            submitted = s.best_submitted(num_problem)
+            if not force and submitted is not None and submitted <= best['dislikes']:
+                replies[num_problem] = {'skipped': 'best pose {} ({} dislikes) does not beat submitted {}'.format(
+                    best['id'], best['dislikes'], submitted)}
+                continue
+            todo.append((num_problem, best))
+
+        # futures are drained on this thread, so each success is recorded as soon as it lands
+        with ThreadPoolExecutor(self.workers) as pool:
+            futures = {pool.submit(self.post_pose, num_problem, best['vertices']): (num_problem, best)
+                       for num_problem, best in todo}
+            for future in as_completed(futures):
+                num_problem, best = futures[future]
+                try:
+                    reply = future.result()
+                except Exception as e:
+                    reply = {'error': str(e)}
+                if 'error' not in reply:
+                    remote_id = reply.get('id')
+                    if remote_id is None:
+                        reply = {'error': 'reply has no id: {}'.format(reply)}
+                    else:
+                        s.add_submission(num_problem, best['id'], remote_id)
+                replies[num_problem] = reply
+        return replies
+
+    def check_solutions(self, nums):
+        s = store.open_store()
+        todo = []
+        replies = {}
+        for num_problem in nums:
+            submission = s.last_submission(num_problem)
+            if submission is None:
+                replies[num_problem] = {'error': 'nothing submitted'}
+            else:
+                todo.append((num_problem, submission['remote_id']))
+
+        checked = self.map(lambda task: self.check_pose(*task), todo)
+        for (num_problem, _), reply in zip(todo, checked):
+            replies[num_problem] = reply
+        return replies
 
-def save_pose_id(num_problem, pose_id):
-    POSES_IDS_PATH = './poses_ids'
-    filename = '{}.id'.format(num_problem)
-    filepath = '{}/{}'.format(POSES_IDS_PATH, filename)
 
-    if os.path.exists(filepath):
-        with open(filepath, 'r') as f:
-            poses = json.load(f)
-    else:
-        poses = {'ids': []}
-
-    poses['ids'].append(pose_id)
-
-    with open(filepath, 'w') as f:
-        json.dump(poses, f)
-
-
-def read_last_pose_id(num_problem):
-    POSES_IDS_PATH = './poses_ids'
-    filename = '{}.id'.format(num_problem)
-    filepath = '{}/{}'.format(POSES_IDS_PATH, filename)
+def hello(token):
+    return Client(token).hello()
 
-    if os.path.exists(filepath):
-        with open(filepath, 'r') as f:
-            poses = json.load(f)
-    else:
-        return -1
 
-    return poses['ids'][-1]
+def post_solution(token, num_problem):
+    return Client(token).post_solutions([int(num_problem)])[int(num_problem)]
 
 
 def check_solution(token, num_problem):
-    pose_id = read_last_pose_id(num_problem)
+    return Client(token).check_solutions([int(num_problem)])[int(num_problem)]
+
 
-    r = requests.get(
-        POSES + '/api/problems/{}/solutions/{}'.format(num_problem, pose_id),
-        headers=header_auth(token),
-    )
-    return r.json()
+def parse_problems(args):
+    if args == ['all']:
+        return problems.all_problems()
+    return [int(a) for a in args]
 
 
 if __name__ == "__main__":
@@ -90,26 +178,26 @@ if __name__ == "__main__":
         print("not enough args")
         sys.exit(1)
 
-    token = read_token()
+    args = sys.argv[2:]
+    force = '--force' in args
+    args = [a for a in args if a != '--force']
+
+    client = Client(read_token())
     if sys.argv[1] == 'post':
-        if len(sys.argv) < 3:
+        if not args:
             print("not enough args")
             sys.exit(1)
 
-        num = sys.argv[2]
-        reply = post_solution(token, num)
-        print(reply)
-        if 'error' not in reply:
-            save_pose_id(num, reply['id'])
+        for num, reply in sorted(client.post_solutions(parse_problems(args), force=force).items()):
+            print(num, reply)
 
     elif sys.argv[1] == 'check':
-        if len(sys.argv) < 3:
+        if not args:
             print("not enough args")
             sys.exit(1)
 
-        num = sys.argv[2]
-
-        print(check_solution(token, num))
+        for num, reply in sorted(client.check_solutions(parse_problems(args)).items()):
+            print(num, reply)
 
     elif sys.argv[1] == 'hello':
-        print(hello(token))
+        print(client.hello())
@@ -0,0 +1,103 @@
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+import anneal
+import placement
+import problems
+import scoring
+import solve
+
+BATCH_PATH = './batch'
+PROGRESS_FILE = '{}/progress.json'.format(BATCH_PATH)
+
+
+def problem_size(num_problem):
+    p = problems.read_problem(num_problem)
+    return len(p.vertices) + len(p.edges)
+
+
+def read_progress():
+    if not os.path.isfile(PROGRESS_FILE):
+        return {}
+    with open(PROGRESS_FILE, 'r') as f:
+        return json.load(f)
+
+
+def write_progress(progress):
+    os.makedirs(BATCH_PATH, exist_ok=True)
+    tmp_file = '{}.tmp'.format(PROGRESS_FILE)
+    with open(tmp_file, 'w') as f:
+        json.dump(progress, f)
+    os.replace(tmp_file, PROGRESS_FILE)
+
+
+def work(task):
+    # one failing problem must not take the pool, and with it the whole batch, down
+    num_problem, budget = task
+    try:
+        return improve_problem(num_problem, budget)
+    except Exception:
+        print("{}: failed".format(num_problem), file=sys.stderr)
+        traceback.print_exc()
+        return num_problem, None, False
+
+
+def improve_problem(num_problem, budget):
+    started = time.monotonic()
+    p = problems.read_problem(num_problem)
+
+    start = problems.read_solution(num_problem)
+    if start is None or scoring.dislikes(p, start) > 0:
+        pinned = placement.pinned_placement(p, budget / 4, seed=num_problem)
+        if pinned is not None:
+            return num_problem, 0, problems.save_solution(num_problem, pinned, problem=p)
+    if start is None:
+        placements = placement.best_rigid_placements(p, k=1)
+        if placements:
+            start = placements[0][1]
+    if start is None:
+        start = solve.Solver(p, time_limit=budget / 2, seed=num_problem).solve()
+    if start is None:
+        return num_problem, None, False
+
+    remaining = budget - (time.monotonic() - started)
+    vertices, dislikes = anneal.improve(p, start, max(remaining, 0.1), seed=num_problem)
+    if vertices is None:
+        return num_problem, None, False
+    improved = problems.save_solution(num_problem, vertices, problem=p)
+    return num_problem, dislikes, improved
+
+
+def run_batch(nums, budget, processes=None):
+    progress = read_progress()
+    todo = [n for n in nums if progress.get(str(n)) is None]
+    todo.sort(key=problem_size, reverse=True)
+
+    # visibility tables are built once per problem, each build spread over the processes itself
+    for num_problem in todo:
+        problems.read_problem(num_problem).use_visibility(build=True)
+
+    with multiprocessing.Pool(processes) as pool:
+        for num_problem, dislikes, improved in pool.imap_unordered(work, [(n, budget) for n in todo]):
+            if dislikes is None:
+                # left out of progress so a resumed run tries it again
+                print("{}: no valid pose".format(num_problem))
+                continue
+            print("{}: dislikes {}{}".format(num_problem, dislikes, ' (new best)' if improved else ''))
+            progress[str(num_problem)] = dislikes
+            write_progress(progress)
+    return progress
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("not enough args")
+        sys.exit(1)
+
+    budget = float(sys.argv[1])
+    nums = [int(n) for n in sys.argv[2:]] or problems.all_problems()
+    run_batch(nums, budget)
@@ -0,0 +1,50 @@
+import os
+import numpy as np
+
+from validation import EPSILON_DENOMINATOR
+
+DISPLACEMENTS_PATH = './cache/displacements'
+
+
+def length_bounds(original_length, epsilon):
+    # integer squared lengths d with 1e6 * |d - d0| <= eps * d0
+    slack = epsilon * original_length // EPSILON_DENOMINATOR
+    return original_length - slack, original_length + slack
+
+
+def enumerate_displacements(original_length, epsilon):
+    lo, hi = length_bounds(original_length, epsilon)
+    r = int(np.sqrt(hi)) + 1
+    dx, dy = np.meshgrid(np.arange(-r, r + 1), np.arange(-r, r + 1), indexing='ij')
+    d = dx * dx + dy * dy
+    keep = (d >= lo) & (d <= hi)
+    return np.stack([dx[keep], dy[keep]], axis=1).astype(np.int64)
+
+
+def load_displacements(original_length, epsilon):
+    filepath = '{}/{}_{}.npy'.format(DISPLACEMENTS_PATH, original_length, epsilon)
+    if os.path.isfile(filepath):
+        return np.load(filepath)
+
+    table = enumerate_displacements(original_length, epsilon)
+    os.makedirs(DISPLACEMENTS_PATH, exist_ok=True)
+    tmp_filepath = '{}.{}.tmp.npy'.format(filepath[:-len('.npy')], os.getpid())
+    np.save(tmp_filepath, table)
+    os.replace(tmp_filepath, filepath)
+    return table
+
+
+class DisplacementTables:
+    def __init__(self, problem):
+        self.epsilon = problem.epsilon
+        self.original_lengths = problem.original_lengths
+        self.tables = {}
+
+    def for_length(self, original_length):
+        original_length = int(original_length)
+        if original_length not in self.tables:
+            self.tables[original_length] = load_displacements(original_length, self.epsilon)
+        return self.tables[original_length]
+
+    def for_edge(self, edge_order):
+        return self.for_length(self.original_lengths[edge_order])
@@ -1,53 +1,51 @@
 import enum
 import math
 import tkinter
-from typing import List, Tuple
+import numpy as np
+from typing import List
 from abc import ABC, abstractmethod
 from itertools import chain
+from geometry import Coords, Delta, distance
+from displacements import length_bounds
 
 class ScaleInfo:
+    # the view transform: screen = lattice * scale + add. every shape of the figure reads the
+    # same instance, so zoom and pan only change these three numbers
     def __init__(self, scale, addx, addy):
         self.scale = scale
         self.addx = addx
         self.addy = addy
 
-Scale = ScaleInfo(15, 100, 50)
-
-class Coords:
-    def __init__(self, x, y):
-        self.x = x
-        self.y = y
+    def zoom(self, factor, anchor: Coords):
+        # the lattice point under anchor stays where it is on screen
+        x, y = self.to_lattice_float(anchor)
+        self.scale *= factor
+        self.addx = anchor.x - x * self.scale
+        self.addy = anchor.y - y * self.scale
 
-    def __mul__(self, scale: int):
-        return Coords(self.x * scale, self.y * scale)
+    def pan(self, dx, dy):
+        self.addx += dx
+        self.addy += dy
 
-    def __add__(self, other: Tuple[int]):
-        return Coords(self.x + other[0], self.y + other[1])
+    def to_screen(self, x, y):
+        return Coords(int(x) * self.scale + self.addx, int(y) * self.scale + self.addy)
 
-    def __repr__(self):
-        return "X: {}, Y: {}".format(self.x, self.y)
+    def to_lattice(self, coords: Coords):
+        return round((coords.x - self.addx) / self.scale), round((coords.y - self.addy) / self.scale)
 
+    def to_lattice_float(self, coords: Coords):
+        return (coords.x - self.addx) / self.scale, (coords.y - self.addy) / self.scale
 
-class Delta:
-    def __init__(self, x, y):
-        self.x = x
-        self.y = y
+Scale = ScaleInfo(15, 100, 50)
 
 
 class Tags(enum.Enum):
     HOLE = 'hole'
     FIGURE_VERTEX = 'figure_vertex'
     FIGURE_EDGE = 'figure_edge'
-
-
-def distance(p1: Coords, p2: Coords):
-    return (p1.x - p2.x) ** 2 + (p1.y - p2.y) ** 2
-
-    # return math.sqrt(
-    #     (p1.x - p2.x) ** 2
-    #     +
-    #     (p1.y - p2.y) ** 2
-    # )
+    # every canvas item of the figure, so whole-figure moves are a single canvas call
+    FIGURE = 'figure'
+    FIGURE_LABEL = 'figure_label'
 
 
 class EntityTypes(enum.Enum):
@@ -59,11 +57,44 @@ class EntityTypes(enum.Enum):
     POLYGON = 6
 
 
+class RedrawQueue:
+    # collects dirty shapes and renders each of them once per frame
+    FRAME_MS = 16
+
+    def __init__(self, canvas: tkinter.Canvas):
+        self.canvas = canvas
+        self.dirty = {}
+        # id of the pending after() frame, None when no frame is scheduled
+        self.pending = None
+        self.before_flush = []
+
+    def mark(self, shape):
+        self.dirty[shape.id] = shape
+        self.schedule()
+
+    def schedule(self):
+        if self.pending is None:
+            self.pending = self.canvas.after(self.FRAME_MS, self.flush)
+
+    def flush(self):
+        # also called directly, e.g. on button release: the pending frame is then dropped. it stays
+        # set while draining, so shapes marked by the callbacks join this frame instead of the next
+        if self.pending is not None:
+            self.canvas.after_cancel(self.pending)
+        for callback in self.before_flush:
+            callback()
+        dirty, self.dirty = self.dirty, {}
+        for shape in dirty.values():
+            shape.render()
+        self.pending = None
+
+
 class CanvasShape(ABC):
     def __init__(self, canvas: tkinter.Canvas):
         self.id = None
         self.canvas = canvas
         self.type = None
+        self.redraw_queue = None
 
     @abstractmethod
     def coords_inside(self, c: Coords):
@@ -85,15 +116,30 @@ class CanvasShape(ABC):
     def snapshot_load(self, snapshot):
         pass
 
+    def render(self):
+        pass
+
+    def redraw(self):
+        if self.redraw_queue is not None:
+            self.redraw_queue.mark(self)
+        else:
+            self.render()
+
     def change_fill(self, color):
+        if getattr(self, 'fill', None) == color:
+            return
         self.fill = color
         self.canvas.itemconfig(self.id, fill=color)
 
     def change_outline(self, color):
+        if getattr(self, 'outline', None) == color:
+            return
         self.outline = color
         self.canvas.itemconfig(self.id, outline=color)
 
     def change_width(self, color):
+        if getattr(self, 'width', None) == color:
+            return
         self.width = color
         self.canvas.itemconfig(self.id, width=color)
 
@@ -154,9 +200,13 @@ class Circle(CanvasShape):
 
 
 class Vertex(Circle):
-    def __init__(self, canvas: tkinter.Canvas, center: Coords, radius: int, order: int, outline='black', fill='', width=1,
-                 tag=Tags.FIGURE_VERTEX, vertices_ids=None, edges_ids=None):
-        super().__init__(canvas, center, radius, outline, fill, width, tag)
+    # the position lives in row `order` of the figure's shared lattice array
+    def __init__(self, canvas: tkinter.Canvas, positions, order: int, radius: int, outline='black', fill='', width=1,
+                 tag=Tags.FIGURE_VERTEX, vertices_ids=None, edges_ids=None, scale_info=None):
+        self.positions = positions
+        self.order = order
+        self.scale_info = scale_info if scale_info is not None else Scale
+        super().__init__(canvas, self.center, radius, outline, fill, width, tag)
         self.type = EntityTypes.VERTEX
         if not vertices_ids:
             self.vertices_ids = []
@@ -166,20 +216,48 @@ class Vertex(Circle):
             self.edges_ids = []
         else:
             self.edges_ids = edges_ids
-        self.order = order
         self.label = None
+        self.spatial_index = None
+
+    @property
+    def center(self):
+        x, y = self.positions[self.order]
+        return self.scale_info.to_screen(x, y)
+
+    @center.setter
+    def center(self, coords: Coords):
+        self.positions[self.order] = self.scale_info.to_lattice(coords)
 
     def draw(self):
         super().draw()
+        self.canvas.addtag_withtag(Tags.FIGURE.value, self.id)
 
         font = ("DejaVu Sans Mono", 8)
-        self.label = tkinter.Label(self.canvas, text=str(self.order), font=font)
-        self.label.place(x=self.center.x + 10, y=self.center.y - 10)
+        center = self.center
+        self.label = self.canvas.create_text(center.x + 10, center.y - 10, text=str(self.order), font=font,
+                                             anchor='nw', tags=(Tags.FIGURE.value, Tags.FIGURE_LABEL.value))
 
+    def move_to(self, x, y):
+        self.positions[self.order] = (x, y)
+        if self.spatial_index is not None:
+            self.spatial_index.move(self.order, x, y)
+        self.redraw()
 
     def move(self, new_center: Coords):
-        super().move(new_center)
-        self.label.place(x=self.center.x + 10, y=self.center.y - 10)
+        self.move_to(*self.scale_info.to_lattice(new_center))
+
+    def render(self):
+        center = self.center
+        top_left, bottom_right = Circle.TLBR_from_center_radius(center, self.radius)
+        self.canvas.coords(self.id, top_left.x, top_left.y, bottom_right.x, bottom_right.y)
+        self.canvas.coords(self.label, center.x + 10, center.y - 10)
+
+    def snapshot_save(self):
+        return [tuple(int(c) for c in self.positions[self.order]), self.radius]
+
+    def snapshot_load(self, snapshot):
+        (x, y), self.radius = snapshot
+        self.move_to(x, y)
 
     def add_vertex_id(self, vertex_id):
         self.vertices_ids.append(vertex_id)
@@ -228,89 +306,92 @@ class Line(CanvasShape):
 
 
 class Edge(Line):
-    def __init__(self, canvas: tkinter.Canvas, p1: Coords, p2: Coords, v1_id: Vertex, v2_id: Vertex, epsilon: int, orig_length, outline='black',
-                 width=3, tag=Tags.FIGURE_EDGE):
-        super().__init__(canvas, p1, p2, outline, width, tag)
+    # endpoints are read from the figure's shared lattice array, never stored per edge
+    def __init__(self, canvas: tkinter.Canvas, positions, v1_order: int, v2_order: int, v1_id, v2_id,
+                 epsilon: int, orig_length, outline='black', width=3, tag=Tags.FIGURE_EDGE, scale_info=None):
+        self.positions = positions
+        self.v1_order = v1_order
+        self.v2_order = v2_order
+        self.scale_info = scale_info if scale_info is not None else Scale
+        super().__init__(canvas, self.p1, self.p2, outline, width, tag)
         self.original_length = orig_length
         self.v1_id = v1_id
         self.v2_id = v2_id
         self.type = EntityTypes.EDGE
         self.epsilon = epsilon
+        self.min_length, self.max_length = length_bounds(orig_length, epsilon)
 
-    def move(self, new_p: Coords):
-        d1 = distance(self.p1, new_p)
-        d2 = distance(self.p2, new_p)
-        if d1 < d2:
-            self.canvas.coords(self.id, new_p.x, new_p.y, self.p2.x, self.p2.y)
-            self.p1 = new_p
-        else:
-            self.canvas.coords(self.id, self.p1.x, self.p1.y, new_p.x, new_p.y)
-            self.p2 = new_p
+    @property
+    def p1(self):
+        return self.scale_info.to_screen(*self.positions[self.v1_order])
+
+    @p1.setter
+    def p1(self, coords: Coords):
+        self.positions[self.v1_order] = self.scale_info.to_lattice(coords)
+
+    @property
+    def p2(self):
+        return self.scale_info.to_screen(*self.positions[self.v2_order])
+
+    @p2.setter
+    def p2(self, coords: Coords):
+        self.positions[self.v2_order] = self.scale_info.to_lattice(coords)
+
+    def draw(self):
+        super().draw()
+        self.canvas.addtag_withtag(Tags.FIGURE.value, self.id)
         self.change_fill(self.calc_color_based_on_length())
 
-    def parallel_move(self, dx, dy):
-        self.canvas.coords(self.id, self.p1.x + dx, self.p1.y + dy, self.p2.x + dx, self.p2.y + dy)
-        self.p1 = Coords(self.p1.x + dx, self.p1.y + dy)
-        self.p2 = Coords(self.p2.x + dx, self.p2.y + dy)
+    def render(self):
+        p1, p2 = self.p1, self.p2
+        self.canvas.coords(self.id, p1.x, p1.y, p2.x, p2.y)
         self.change_fill(self.calc_color_based_on_length())
 
-    def length_if_moved(self, new_p: Coords):
-        d1 = distance(self.p1, new_p)
-        d2 = distance(self.p2, new_p)
-        if d1 < d2:
-            return distance(new_p, self.p2)
-        else:
-            return distance(self.p1, new_p)
+    def move(self, new_p: Coords):
+        # the vertex has already written its new position into the shared array
+        self.redraw()
+
+    def lattice_length(self):
+        d = self.positions[self.v1_order] - self.positions[self.v2_order]
+        return int(d @ d)
+
+    def length_if_moved(self, vertex_order, x, y):
+        other = self.v2_order if vertex_order == self.v1_order else self.v1_order
+        ox, oy = self.positions[other]
+        return (int(ox) - x) ** 2 + (int(oy) - y) ** 2
+
+    def length_fits(self, length):
+        return self.min_length <= length <= self.max_length
 
     def snapshot_save(self):
-        return [
-            self.p1, self.p2, self.epsilon
-        ]
+        return [self.epsilon]
 
     def snapshot_load(self, snapshot):
-        self.p1, self.p2, self.epsilon = snapshot
-        self.canvas.coords(self.id, self.p1.x, self.p1.y, self.p2.x, self.p2.y)
+        self.epsilon, = snapshot
+        self.min_length, self.max_length = length_bounds(self.original_length, self.epsilon)
+        self.redraw()
 
     def calc_color_based_on_length(self):
-        original_length = self.original_length
-        new_length = distance(self.p1, self.p2)
-
-        scale = Scale.scale
-        addx = Scale.addx
-        addy = Scale.addy
-        x1 = self.p1.x
-        x2 = self.p2.x
-        y1 = self.p1.y
-        y2 = self.p2.y
-
-        x1 -= addx
-        x2 -= addx
-        y1 -= addy
-        y2 -= addy
-        x1 = round(x1 / scale)
-        x2 = round(x2 / scale)
-        y1 = round(y1 / scale)
-        y2 = round(y2 / scale)
-
-        new_length = distance(Coords(x1, y1), Coords(x2, y2))
+        new_length = self.lattice_length()
+        if self.length_fits(new_length):
+            return 'black'
 
+        original_length = self.original_length
         color_range = 100
         color_offset = 150
         margin = 2
 
-        if abs(new_length / original_length - 1) > (self.epsilon / 1_000_000):
-            if new_length > original_length:
-                red_amount = int(color_offset + \
-                             min((new_length / original_length - 1), (margin - 1)) * (color_range - 1))
-                color = '#{:02x}0000'.format(red_amount)
-                return color
-            else:
-                blue_amount = int(color_offset + \
-                             min((original_length / new_length - 1), (margin - 1)) * (color_range - 1))
-                color = '#0000{:02x}'.format(blue_amount)
-                return color
+        # only out-of-bounds edges get here, the ratios just pick the shade
+        if new_length > original_length:
+            red_amount = int(color_offset + \
+                         min((new_length / original_length - 1), (margin - 1)) * (color_range - 1))
+            color = '#{:02x}0000'.format(red_amount)
+            return color
         else:
-            return 'black'
+            blue_amount = int(color_offset + \
+                         min((original_length / max(new_length, 1) - 1), (margin - 1)) * (color_range - 1))
+            color = '#0000{:02x}'.format(blue_amount)
+            return color
 
 
 
@@ -362,3 +443,48 @@ class Polygon(CanvasShape):
         self.canvas.coords(self.id, *pts_flat)
         self.pts = pts
 
+
+class Hole(Polygon):
+    # a polygon kept in lattice space, re-projected through the view transform on render
+    def __init__(self, canvas: tkinter.Canvas, lattice_pts, outline='black', width=1, tag=Tags.HOLE.value, fill='',
+                 scale_info=None):
+        self.lattice_pts = lattice_pts
+        self.scale_info = scale_info if scale_info is not None else Scale
+        super().__init__(canvas, self.screen_pts(), outline, width, tag, fill)
+
+    def screen_pts(self):
+        return [self.scale_info.to_screen(x, y) for x, y in self.lattice_pts]
+
+    def render(self):
+        self.pts = self.screen_pts()
+        self.canvas.coords(self.id, *chain.from_iterable((pt.x, pt.y) for pt in self.pts))
+
+
+def draw_problem(problem, canvas, entities, scale_info=None, vertices=None):
+    scale_info = scale_info if scale_info is not None else Scale
+
+    p = Hole(canvas, problem.hole, scale_info=scale_info)
+    p.draw()
+    entities.add_entity(p)
+
+    entities.positions = np.array(problem.vertices if vertices is None else vertices, dtype=np.int64)
+    vertices_ids = []
+    for order in range(len(entities.positions)):
+        v = Vertex(canvas, entities.positions, order, 3, scale_info=scale_info)
+        v.draw()
+        vertices_ids.append(v.id)
+        entities.add_entity(v)
+
+    for (pt1, pt2), orig_length in zip(problem.edges, problem.original_lengths):
+        e = Edge(canvas,
+                 entities.positions,
+                 int(pt1),
+                 int(pt2),
+                 vertices_ids[pt1],
+                 vertices_ids[pt2],
+                 epsilon=problem.epsilon,
+                 orig_length=int(orig_length),
+                 tag=Tags.FIGURE_EDGE,
+                 scale_info=scale_info)
+        e.draw()
+        entities.add_entity(e)
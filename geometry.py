@@ -0,0 +1,195 @@
+import math
+from typing import Tuple
+import numpy as np
+
+
+class Coords:
+    __slots__ = ('x', 'y')
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+    def __mul__(self, scale: int):
+        return Coords(self.x * scale, self.y * scale)
+
+    def __add__(self, other: Tuple[int]):
+        return Coords(self.x + other[0], self.y + other[1])
+
+    def __repr__(self):
+        return "X: {}, Y: {}".format(self.x, self.y)
+
+    def __getstate__(self):
+        return {'x': self.x, 'y': self.y}
+
+    def __setstate__(self, state):
+        # states pickled before __slots__ carry a plain attribute dict
+        self.x, self.y = state['x'], state['y']
+
+
+class Delta:
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+
+def distance(p1: Coords, p2: Coords):
+    return (p1.x - p2.x) ** 2 + (p1.y - p2.y) ** 2
+
+    # return math.sqrt(
+    #     (p1.x - p2.x) ** 2
+    #     +
+    #     (p1.y - p2.y) ** 2
+    # )
+
+
+# lattice-preserving linear maps, screen orientation (y grows downwards)
+ROTATE_CW = np.array([[0, -1], [1, 0]], dtype=np.int64)
+MIRROR_X = np.array([[-1, 0], [0, 1]], dtype=np.int64)
+MIRROR_Y = np.array([[1, 0], [0, -1]], dtype=np.int64)
+
+# the 8 symmetries of the square lattice: 4 rotations, each with and without a mirror
+LATTICE_SYMMETRIES = np.array([np.linalg.matrix_power(ROTATE_CW, turns) @ mirror
+                               for mirror in (np.eye(2, dtype=np.int64), MIRROR_X)
+                               for turns in range(4)], dtype=np.int64)
+
+
+def transform_about(points, matrix, pivot):
+    return (points - pivot) @ matrix.T + pivot
+
+
+def polygon_mask(polygon, x0, y0, width, height):
+    # bool array m[x - x0, y - y0]: lattice point inside polygon or on its boundary
+    xs, ys = np.meshgrid(np.arange(x0, x0 + width, dtype=np.int64),
+                         np.arange(y0, y0 + height, dtype=np.int64), indexing='ij')
+    inside = np.zeros((width, height), dtype=bool)
+    boundary = np.zeros((width, height), dtype=bool)
+    for (ax, ay), (bx, by) in zip(polygon, np.roll(polygon, -1, axis=0)):
+        cross = (bx - ax) * (ys - ay) - (xs - ax) * (by - ay)
+        straddles = (ay > ys) != (by > ys)
+        inside ^= straddles & (cross * (by - ay) > 0)
+        boundary |= ((cross == 0)
+                     & (min(ax, bx) <= xs) & (xs <= max(ax, bx))
+                     & (min(ay, by) <= ys) & (ys <= max(ay, by)))
+    return inside | boundary
+
+
+def orientation(a, b, c):
+    # sign of the cross product (b - a) x (c - a), broadcasting over c or over a/b
+    return np.sign((b[..., 0] - a[..., 0]) * (c[..., 1] - a[..., 1])
+                   - (b[..., 1] - a[..., 1]) * (c[..., 0] - a[..., 0]))
+
+
+class SegmentIndex:
+    CELL_SIZE = 8
+
+    def __init__(self, polygon):
+        self.starts = np.asarray(polygon, dtype=np.int64)
+        self.ends = np.roll(self.starts, -1, axis=0)
+        self.min = self.starts.min(axis=0)
+        width, height = self.starts.max(axis=0) - self.min + 1
+
+        # doubled lattice: every midpoint of an integer segment is a point of it
+        self.half_mask = polygon_mask(self.starts * 2, 2 * self.min[0], 2 * self.min[1],
+                                      2 * width - 1, 2 * height - 1)
+
+        cells_x, cells_y = (width - 1) // self.CELL_SIZE + 1, (height - 1) // self.CELL_SIZE + 1
+        cells = [[[] for _ in range(cells_y)] for _ in range(cells_x)]
+        lo = (np.minimum(self.starts, self.ends) - self.min) // self.CELL_SIZE
+        hi = (np.maximum(self.starts, self.ends) - self.min) // self.CELL_SIZE
+        for edge_order in range(len(self.starts)):
+            for cx in range(lo[edge_order][0], hi[edge_order][0] + 1):
+                for cy in range(lo[edge_order][1], hi[edge_order][1] + 1):
+                    cells[cx][cy].append(edge_order)
+        self.cells = [[np.array(cell, dtype=np.int64) for cell in column] for column in cells]
+
+    def _inside_doubled(self, pt2):
+        x, y = pt2[0] - 2 * self.min[0], pt2[1] - 2 * self.min[1]
+        width, height = self.half_mask.shape
+        return 0 <= x < width and 0 <= y < height and bool(self.half_mask[x, y])
+
+    def candidate_edges(self, p, q):
+        lo = (np.maximum(np.minimum(p, q) - self.min, 0)) // self.CELL_SIZE
+        hi = (np.maximum(p, q) - self.min) // self.CELL_SIZE
+        found = [self.cells[cx][cy]
+                 for cx in range(lo[0], min(hi[0] + 1, len(self.cells)))
+                 for cy in range(lo[1], min(hi[1] + 1, len(self.cells[0])))]
+        if not found:
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate(found))
+
+    def segment_inside(self, p, q):
+        # exact test for the closed segment pq lying inside the closed polygon
+        p = np.asarray(p, dtype=np.int64)
+        q = np.asarray(q, dtype=np.int64)
+        if not (self._inside_doubled(2 * p) and self._inside_doubled(2 * q)):
+            return False
+
+        candidates = self.candidate_edges(p, q)
+        if not len(candidates):
+            return True
+        a, b = self.starts[candidates], self.ends[candidates]
+
+        o_a, o_b = orientation(p, q, a), orientation(p, q, b)
+        o_p, o_q = orientation(a, b, p), orientation(a, b, q)
+        if np.any((o_a * o_b < 0) & (o_p * o_q < 0)):
+            return False
+
+        # polygon corners touching pq split it into pieces that are each
+        # entirely inside, outside or on the boundary; test their midpoints
+        pq = q - p
+        t = (a - p) @ pq
+        touching = a[(o_a == 0) & (t > 0) & (t < pq @ pq)]
+        if len(touching):
+            touching = np.unique(touching, axis=0)
+            touching = touching[np.argsort((touching - p) @ pq)]
+        pts = np.vstack([p, touching, q]) if len(touching) else np.vstack([p, q])
+        for mid2 in pts[:-1] + pts[1:]:
+            if not self._inside_doubled(mid2):
+                return False
+        return True
+
+
+class SpatialHash:
+    # uniform grid of buckets mapping cell -> keys of the points inside it
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.cell_of = {}
+
+    def cell(self, x, y):
+        return int(x) // self.cell_size, int(y) // self.cell_size
+
+    def insert(self, key, x, y):
+        cell = self.cell(x, y)
+        self.cells.setdefault(cell, set()).add(key)
+        self.cell_of[key] = cell
+
+    def remove(self, key):
+        cell = self.cell_of.pop(key, None)
+        if cell is not None:
+            bucket = self.cells[cell]
+            bucket.discard(key)
+            if not bucket:
+                del self.cells[cell]
+
+    def move(self, key, x, y):
+        cell = self.cell(x, y)
+        if self.cell_of.get(key) != cell:
+            self.remove(key)
+            self.insert(key, x, y)
+
+    def rebuild(self, positions):
+        self.cells.clear()
+        self.cell_of.clear()
+        for key, (x, y) in enumerate(positions):
+            self.insert(key, x, y)
+
+    def query(self, x0, y0, x1, y1):
+        cx0, cy0 = self.cell(math.floor(x0), math.floor(y0))
+        cx1, cy1 = self.cell(math.floor(x1), math.floor(y1))
+        found = []
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                found.extend(self.cells.get((cx, cy), ()))
+        return found
@@ -0,0 +1,133 @@
+import sys
+import time
+import numpy as np
+
+import problems
+import scoring
+import solve
+from geometry import LATTICE_SYMMETRIES
+
+# cap on hole x vertex x candidate distance terms scored at once
+SCORE_CHUNK_TERMS = 1 << 22
+
+
+def translation_mask(problem, shape):
+    # valid[tx, ty]: every vertex of shape + (tx, ty) + offset lands on the hole lattice mask,
+    # where offset places the shape's bounding box at the hole's bounding box origin
+    width, height = problem.hole_mask.shape
+    shape = shape - shape.min(axis=0)
+    span_x, span_y = shape.max(axis=0)
+    if span_x >= width or span_y >= height:
+        return None
+    valid = np.ones((width - span_x, height - span_y), dtype=bool)
+    for x, y in np.unique(shape, axis=0):
+        valid &= problem.hole_mask[x:x + width - span_x, y:y + height - span_y]
+    return valid
+
+
+def rigid_candidates(problem):
+    # every symmetry x translation of the original figure whose vertices are all inside the hole
+    candidates = []
+    for matrix in LATTICE_SYMMETRIES:
+        shape = problem.vertices @ matrix.T
+        valid = translation_mask(problem, shape)
+        if valid is None:
+            continue
+        offsets = np.argwhere(valid) + problem.hole_min - shape.min(axis=0)
+        if len(offsets):
+            candidates.append(shape[None, :, :] + offsets[:, None, :])
+    if not candidates:
+        return np.empty((0,) + problem.vertices.shape, dtype=np.int64)
+    return np.unique(np.concatenate(candidates), axis=0)
+
+
+def rank_by_dislikes(problem, candidates):
+    chunk = max(1, SCORE_CHUNK_TERMS // (len(problem.hole) * len(problem.vertices)))
+    scores = np.concatenate([np.atleast_1d(scoring.dislikes(problem, candidates[i:i + chunk]))
+                             for i in range(0, len(candidates), chunk)]) if len(candidates) else np.empty(0)
+    order = np.argsort(scores, kind='stable')
+    return candidates[order], scores[order]
+
+
+def best_rigid_placements(problem, k=10):
+    # rigid moves keep every edge length, so only the segments need an exact check
+    candidates, scores = rank_by_dislikes(problem, rigid_candidates(problem))
+    found = []
+    for vertices, dislikes in zip(candidates, scores):
+        if problem.pose_inside(vertices):
+            found.append((int(dislikes), vertices))
+            if len(found) >= k:
+                break
+    return found
+
+
+def corner_assignments(problem, deadline=None):
+    # yields {vertex: corner} pinning a distinct figure vertex on every hole corner. candidates[i]
+    # holds the vertices corner i can still take: a vertex is dropped once some assigned pair of
+    # corners is further apart than the two vertices can ever get, and the most constrained
+    # corner is assigned next
+    reach = problem.graph_distances() + 1e-9
+    d = problem.hole[:, None, :] - problem.hole[None, :, :]
+    corner_distances = np.sqrt((d * d).sum(axis=2))
+    assigned = {}
+
+    def extend(candidates, left):
+        if not left:
+            yield dict(assigned)
+            return
+        if deadline is not None and time.monotonic() > deadline:
+            return
+        rest = np.array(left)
+        i = left[int(candidates[rest].sum(axis=1).argmin())]
+        others = [j for j in left if j != i]
+        for v in np.flatnonzero(candidates[i]).tolist():
+            narrowed = candidates.copy()
+            narrowed[:, v] = False
+            if others:
+                narrowed[others] &= reach[v][None, :] >= corner_distances[i, others][:, None]
+                if not narrowed[others].any(axis=1).all():
+                    continue
+            assigned[v] = i
+            yield from extend(narrowed, others)
+            del assigned[v]
+
+    return extend(np.ones((len(problem.hole), len(problem.vertices)), dtype=bool), list(range(len(problem.hole))))
+
+
+def pinned_placement(problem, time_limit, attempt_limit=0.5, seed=0):
+    # zero-dislike search: the solver runs once per surviving corner assignment
+    deadline = time.monotonic() + time_limit
+    solver = solve.Solver(problem, seed=seed)
+    corner_bits = solver.bits_of(problem.hole)
+    for assignment in corner_assignments(problem, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        solver.time_limit = min(attempt_limit, remaining)
+        vertices = solver.solve(pinned={v: corner_bits[i] for v, i in assignment.items()})
+        if vertices is not None:
+            return vertices
+    return None
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("not enough args")
+        sys.exit(1)
+
+    num = int(sys.argv[1])
+    p = problems.read_problem(num)
+    if len(sys.argv) > 2 and sys.argv[2] == 'corners':
+        vertices = pinned_placement(p, float(sys.argv[3]) if len(sys.argv) > 3 else 60)
+        if vertices is None:
+            print("no pinned placement found")
+            sys.exit(1)
+        problems.save_solution(num, vertices, problem=p)
+        print("dislikes: {}".format(scoring.dislikes(p, vertices)))
+        sys.exit(0)
+
+    placements = best_rigid_placements(p, k=int(sys.argv[2]) if len(sys.argv) > 2 else 10)
+    for dislikes, _ in placements:
+        print("dislikes: {}".format(dislikes))
+    if placements:
+        problems.save_solution(num, placements[0][1], problem=p)
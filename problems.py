@@ -1,72 +1,213 @@
-from drawing import Coords, Circle, Line, Polygon, Tags, Edge, Vertex, EntityTypes, distance
+import hashlib
 import json
+import os
+import numpy as np
+from scipy.sparse.csgraph import csgraph_from_dense, shortest_path
+from geometry import polygon_mask, SegmentIndex
+from displacements import DisplacementTables, length_bounds
+import scoring
+import store
+import validation
+import visibility
 
 PROBLEMS_PATH = './problems'
+PROBLEMS_COUNT = 88
+SOLUTIONS_PATH = './solutions'
+CACHE_PATH = './cache/problems'
+CACHE_VERSION = 2
+CACHED_ARRAYS = ('hole', 'vertices', 'edges', 'original_lengths', 'min_lengths', 'max_lengths',
+                 'hole_min', 'hole_mask')
+
+
+def all_problems():
+    return list(range(1, PROBLEMS_COUNT + 1))
 
 
 class Problem:
-    def __init__(self, json_contents):
+    def __init__(self, json_contents, num=None):
+        self.num = num
         self.epsilon = json_contents['epsilon']
-        self.hole = []
-        for pt in json_contents['hole']:
-            self.hole.append(Coords(pt[0], pt[1]))
-        self.figure = {}
-        self.figure['edges'] = json_contents['figure']['edges']
-        self.figure['vertices'] = []
-        for pt in json_contents['figure']['vertices']:
-            self.figure['vertices'].append(Coords(pt[0], pt[1]))
-
-    def draw_problem(self, canvas, entities, scale=1, addx=0, addy=0):
-        scaling_function = lambda c: c * scale
-        moving_function = lambda c: c + (addx, addy)
-        scaled_hole = list(map(scaling_function, self.hole))
-        scaled_hole = list(map(moving_function, scaled_hole))
-
-        p = Polygon(canvas, scaled_hole, tag='hole')
-        p.draw()
-        entities.add_entity(p)
-
-        scaled_vertices = list(map(scaling_function, self.figure['vertices']))
-        scaled_vertices = list(map(moving_function, scaled_vertices))
-        vertices_ids = []
-        for order, vertex in enumerate(scaled_vertices):
-            v = Vertex(canvas, vertex, 3, order)
-            v.draw()
-            vertices_ids.append(v.id)
-            entities.add_entity(v)
-
-        for pt1, pt2 in self.figure['edges']:
-            e = Edge(canvas,
-                     scaled_vertices[pt1],
-                     scaled_vertices[pt2],
-                     vertices_ids[pt1],
-                     vertices_ids[pt2],
-                     epsilon=self.epsilon,
-                     orig_length=distance(self.figure['vertices'][pt1], self.figure['vertices'][pt2]),
-                     # orig_length=distance(scaled_vertices[pt1], scaled_vertices[pt2]),
-                     tag=Tags.FIGURE_EDGE)
-            e.draw()
-            entities.add_entity(e)
-
-
-def save_solution(entities, num_problem, scale=1, addx=0, addy=0):
-    SOLUTIONS_PATH = './solutions'
+        self.hole = np.array(json_contents['hole'], dtype=np.int64)
+        self.vertices = np.array(json_contents['figure']['vertices'], dtype=np.int64)
+        self.edges = np.array(json_contents['figure']['edges'], dtype=np.int64).reshape(-1, 2)
+        self.bonuses = json_contents.get('bonuses', [])
+
+        d = self.vertices[self.edges[:, 0]] - self.vertices[self.edges[:, 1]]
+        self.original_lengths = (d * d).sum(axis=1)
+        # legal squared lengths per edge: a pose is valid iff min_lengths <= length <= max_lengths
+        self.min_lengths, self.max_lengths = length_bounds(self.original_lengths, self.epsilon)
+
+        self.hole_min = self.hole.min(axis=0)
+        width, height = self.hole.max(axis=0) - self.hole_min + 1
+        self.hole_mask = polygon_mask(self.hole, self.hole_min[0], self.hole_min[1], width, height)
+        self._cache_dir = None
+        self.digest = None
+        self._segment_index = None
+        self._graph_distances = None
+        self._visibility = None
+        self.displacements = DisplacementTables(self)
+
+    @classmethod
+    def from_cache(cls, cache_dir, meta, num=None):
+        # arrays are memory-mapped on first access, see __getattr__
+        problem = cls.__new__(cls)
+        problem.num = num
+        problem.epsilon = meta['epsilon']
+        problem.bonuses = meta['bonuses']
+        problem._cache_dir = cache_dir
+        problem.digest = meta['hash']
+        problem._segment_index = None
+        problem._graph_distances = None
+        problem._visibility = None
+        problem.displacements = DisplacementTables(problem)
+        return problem
+
+    def __getattr__(self, name):
+        cache_dir = self.__dict__.get('_cache_dir')
+        if cache_dir is None or name not in CACHED_ARRAYS:
+            raise AttributeError(name)
+        value = np.load('{}/{}.npy'.format(cache_dir, name), mmap_mode='r')
+        setattr(self, name, value)
+        return value
+
+    def inside(self, pts):
+        # pts: (..., 2) integer lattice points -> (...) bool, boundary counts as inside
+        pts = np.asarray(pts, dtype=np.int64) - self.hole_min
+        x, y = pts[..., 0], pts[..., 1]
+        width, height = self.hole_mask.shape
+        in_box = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+        result = np.zeros(x.shape, dtype=bool)
+        result[in_box] = self.hole_mask[x[in_box], y[in_box]]
+        return result
+
+    def neighbour_candidates(self, edge_order, pt):
+        # lattice points inside the hole at a legal distance from pt along the given edge
+        candidates = self.displacements.for_edge(edge_order) + pt
+        return candidates[self.inside(candidates)]
+
+    def segment_index(self):
+        if self._segment_index is None:
+            self._segment_index = SegmentIndex(self.hole)
+        return self._segment_index
+
+    def use_visibility(self, build=False):
+        # answer segment_inside from the cached visibility table when there is one
+        if self._visibility is None:
+            self._visibility = visibility.load_visibility(self, build=build)
+        return self._visibility is not None
+
+    def segment_inside(self, p, q):
+        if self._visibility is not None:
+            inside = self._visibility.lookup(p, q)
+            if inside is not None:
+                return inside
+        return self.segment_index().segment_inside(p, q)
+
+    def pose_inside(self, vertices):
+        vertices = np.asarray(vertices, dtype=np.int64)
+        if not self.inside(vertices).all():
+            return False
+        index = self.segment_index()
+        return all(index.segment_inside(vertices[v1], vertices[v2]) for v1, v2 in self.edges)
+
+    def graph_distances(self):
+        # (n, n) upper bounds on the distance between any two figure vertices in a valid pose:
+        # shortest paths over the longest length each edge may be stretched to
+        if self._graph_distances is None:
+            n = len(self.vertices)
+            weights = np.full((n, n), np.inf)
+            np.minimum.at(weights, (self.edges[:, 0], self.edges[:, 1]), np.sqrt(self.max_lengths))
+            graph = csgraph_from_dense(weights, null_value=np.inf)
+            self._graph_distances = shortest_path(graph, directed=False)
+        return self._graph_distances
+
+    def adjacency(self):
+        adjacent = [[] for _ in range(len(self.vertices))]
+        for edge_order, (v1, v2) in enumerate(self.edges):
+            adjacent[v1].append((int(v2), edge_order))
+            adjacent[v2].append((int(v1), edge_order))
+        return adjacent
+
+
+def source_hash(problem_number: int):
+    with open('{}/{}.problem'.format(PROBLEMS_PATH, problem_number), mode='rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def read_cache_meta(cache_dir):
+    try:
+        with open('{}/meta.json'.format(cache_dir), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_problem_cache(problem, cache_dir, digest):
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_suffix = '.{}.tmp'.format(os.getpid())
+    for name in CACHED_ARRAYS:
+        filepath = '{}/{}.npy'.format(cache_dir, name)
+        with open(filepath + tmp_suffix, 'wb') as f:
+            np.save(f, np.ascontiguousarray(getattr(problem, name)))
+        os.replace(filepath + tmp_suffix, filepath)
+
+    # meta goes last: a cache directory only counts once its meta matches the source
+    meta = {'version': CACHE_VERSION, 'hash': digest, 'epsilon': problem.epsilon, 'bonuses': problem.bonuses}
+    filepath = '{}/meta.json'.format(cache_dir)
+    with open(filepath + tmp_suffix, 'w') as f:
+        json.dump(meta, f)
+    os.replace(filepath + tmp_suffix, filepath)
+
+
+def export_solution(num_problem, vertices):
     filename = '{}.solution'.format(num_problem)
     filepath = '{}/{}'.format(SOLUTIONS_PATH, filename)
-    vertices = []
-    for v_id in entities.ids_by_type[EntityTypes.VERTEX]:
-        v = entities.data[v_id]
-        x, y = v.center.x, v.center.y
-        x -= addx
-        y -= addy
-        x = round(x / scale)
-        y = round(y / scale)
-        vertices.append([int(x), int(y)])
-    with open(filepath, 'w') as f:
+    vertices = [[int(x), int(y)] for x, y in vertices]
+    os.makedirs(SOLUTIONS_PATH, exist_ok=True)
+    tmp_path = '{}.{}.tmp'.format(filepath, os.getpid())
+    with open(tmp_path, 'w') as f:
         json.dump({'vertices': vertices}, f)
+    os.replace(tmp_path, filepath)
+
+
+def record_solution(num_problem, vertices, problem=None, bonuses=(), export=True):
+    # every pose goes into the store; solutions/<n>.solution only ever follows the best valid one
+    if problem is None:
+        problem = read_problem(num_problem)
+    vertices = np.asarray(vertices, dtype=np.int64)
+    valid = vertices.shape == problem.vertices.shape and validation.pose_is_valid(problem, vertices)
+    dislikes = scoring.dislikes(problem, vertices)
+    # exporting under the store's write lock keeps concurrent writers from landing out of order
+    on_best = (lambda best: export_solution(num_problem, best)) if export else None
+    pose_id, improved = store.open_store().add_pose(num_problem, vertices, dislikes, valid, bonuses, on_best)
+    return pose_id, improved
+
+
+def save_solution(num_problem, vertices, problem=None):
+    return record_solution(num_problem, vertices, problem)[1]
+
+
+def read_solution(num_problem):
+    best = store.open_store().best(num_problem)
+    if best is None:
+        return None
+    return np.array(best['vertices'], dtype=np.int64)
 
 
 def read_problem_json(problem_number: int):
     with open('{}/{}.problem'.format(PROBLEMS_PATH, problem_number), mode='r') as f:
         contents = json.load(f)
     return contents
+
+
+def read_problem(problem_number: int):
+    cache_dir = '{}/{}'.format(CACHE_PATH, problem_number)
+    digest = source_hash(problem_number)
+    meta = read_cache_meta(cache_dir)
+    if meta is not None and meta.get('version') == CACHE_VERSION and meta.get('hash') == digest:
+        return Problem.from_cache(cache_dir, meta, num=problem_number)
+
+    problem = Problem(read_problem_json(problem_number), num=problem_number)
+    problem.digest = digest
+    write_problem_cache(problem, cache_dir, digest)
+    return problem
@@ -0,0 +1,106 @@
+import sys
+import numpy as np
+from scipy.ndimage import distance_transform_edt
+
+import anneal
+import problems
+import validation
+
+RELAX_ITERATIONS = 200
+RELAX_STEP = 0.5
+RELAX_TOLERANCE = 1e-3
+POLISH_PASSES = 3
+POLISH_MOVES = np.array([(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx or dy], dtype=np.int64)
+
+
+class Relaxer:
+    # springs pull every edge toward its original length, vertices outside the hole are
+    # pulled to the nearest lattice point inside it; pinned vertices never move
+    def __init__(self, problem: problems.Problem):
+        self.problem = problem
+        self.targets = np.sqrt(problem.original_lengths)
+        n = len(problem.vertices)
+        self.degree = np.maximum(np.bincount(problem.edges.ravel(), minlength=n), 1)
+
+        # nearest inside lattice point for every cell of the hole's bounding box
+        _, indices = distance_transform_edt(~np.asarray(problem.hole_mask), return_indices=True)
+        self.nearest_inside = np.stack(indices, axis=-1) + problem.hole_min
+        self.adjacent = problem.adjacency()
+
+    def pull_inside(self, pts):
+        lattice = np.rint(pts).astype(np.int64)
+        outside = ~self.problem.inside(lattice)
+        cells = np.clip(lattice - self.problem.hole_min, 0, np.array(self.problem.hole_mask.shape) - 1)
+        nearest = self.nearest_inside[cells[:, 0], cells[:, 1]]
+        return np.where(outside[:, None], nearest - pts, 0.0)
+
+    def spring_forces(self, pts):
+        v1, v2 = self.problem.edges[:, 0], self.problem.edges[:, 1]
+        d = pts[v2] - pts[v1]
+        lengths = np.hypot(d[:, 0], d[:, 1])
+        correction = ((lengths - self.targets) / np.maximum(lengths, 1e-9) / 2)[:, None] * d
+        n = len(pts)
+        forces = np.empty_like(pts)
+        for axis in (0, 1):
+            forces[:, axis] = (np.bincount(v1, correction[:, axis], n) -
+                               np.bincount(v2, correction[:, axis], n))
+        return forces / self.degree[:, None]
+
+    def badness(self, vertices):
+        violations, _ = validation.check_stretch(self.problem, vertices)
+        return int(violations.sum()) + int((~self.problem.inside(vertices)).sum())
+
+    def vertex_badness(self, vertices, v, candidates):
+        # (k,) stretch violations on v's edges plus outside flags for candidate positions of v
+        others = np.array([u for u, _ in self.adjacent[v]], dtype=np.int64)
+        edge_orders = np.array([e for _, e in self.adjacent[v]], dtype=np.int64)
+        d = candidates[:, None, :] - vertices[others][None, :, :]
+        lengths = (d * d).sum(axis=2)
+        bad = (lengths < self.problem.min_lengths[edge_orders]) | (lengths > self.problem.max_lengths[edge_orders])
+        return bad.sum(axis=1) + ~self.problem.inside(candidates)
+
+    def polish(self, vertices, free):
+        # rounding may break a few edges: nudge their free endpoints by one lattice step
+        for _ in range(POLISH_PASSES):
+            violations, valid = validation.check_stretch(self.problem, vertices)
+            outside = ~self.problem.inside(vertices)
+            if valid and not outside.any():
+                break
+            bad = np.zeros(len(vertices), dtype=bool)
+            bad[self.problem.edges[violations].ravel()] = True
+            bad |= outside
+            for v in np.flatnonzero(bad & free).tolist():
+                candidates = np.vstack([vertices[v:v + 1], vertices[v] + POLISH_MOVES])
+                vertices[v] = candidates[int(self.vertex_badness(vertices, v, candidates).argmin())]
+        return vertices
+
+    def relax(self, vertices, pinned=(), iterations=RELAX_ITERATIONS):
+        start = np.asarray(vertices, dtype=np.int64)
+        free = np.ones(len(start), dtype=bool)
+        free[list(pinned)] = False
+
+        pts = start.astype(float)
+        for _ in range(iterations):
+            step = RELAX_STEP * self.spring_forces(pts) + self.pull_inside(pts)
+            step[~free] = 0
+            pts += step
+            if np.abs(step).max() < RELAX_TOLERANCE:
+                break
+
+        relaxed = self.polish(np.rint(pts).astype(np.int64), free)
+        return relaxed if self.badness(relaxed) <= self.badness(start) else start.copy()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("not enough args")
+        sys.exit(1)
+
+    num = int(sys.argv[1])
+    p = problems.read_problem(num)
+    relaxer = Relaxer(p)
+    start = anneal.read_start_pose(sys.argv[2])
+    vertices = relaxer.relax(start)
+    print("bad before: {}, after: {}".format(relaxer.badness(start), relaxer.badness(vertices)))
+    if validation.pose_is_valid(p, vertices):
+        problems.save_solution(num, vertices, problem=p)
@@ -0,0 +1,30 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+# above this many hole x vertex pairs per pose a KD-tree beats the dense distance matrix
+DENSE_PAIRS_LIMIT = 4096
+
+
+def _dislikes_dense(hole, vertices):
+    d = hole[:, None, :] - vertices[..., None, :, :]
+    return (d * d).sum(axis=-1).min(axis=-1).sum(axis=-1)
+
+
+def _dislikes_tree(hole, vertices):
+    _, nearest = cKDTree(vertices).query(hole)
+    d = hole - vertices[nearest]
+    return (d * d).sum()
+
+
+def dislikes(problem, vertices):
+    # vertices: (N, 2) pose -> int, or (B, N, 2) batch of poses -> (B,) array
+    vertices = np.asarray(vertices, dtype=np.int64)
+    hole = problem.hole
+    if len(hole) * vertices.shape[-2] <= DENSE_PAIRS_LIMIT:
+        if vertices.ndim == 2:
+            return int(_dislikes_dense(hole, vertices))
+        return _dislikes_dense(hole, vertices)
+
+    if vertices.ndim == 2:
+        return int(_dislikes_tree(hole, vertices))
+    return np.array([_dislikes_tree(hole, pose) for pose in vertices], dtype=np.int64)
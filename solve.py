@@ -1,6 +1,136 @@
-def solve():
+import sys
+import time
+import numpy as np
+
+import problems
+import scoring
+
+
+class SolveTimeout(Exception):
     pass
 
 
+class Solver:
+    def __init__(self, problem: problems.Problem, time_limit=None, seed=0):
+        self.problem = problem
+        self.time_limit = time_limit
+        self.rng = np.random.default_rng(seed)
+        self.deadline = None
+
+        # bit i of a domain stands for the i-th lattice point inside the hole
+        self.points = np.argwhere(problem.hole_mask) + problem.hole_min
+        self.bit_by_cell = np.full(problem.hole_mask.shape, -1, dtype=np.int64)
+        self.bit_by_cell[problem.hole_mask] = np.arange(len(self.points))
+        self.nbytes = (len(self.points) + 7) // 8
+        self.full = (1 << len(self.points)) - 1
+
+        problem.use_visibility()
+        self.adjacent = problem.adjacency()
+        self.corner_bits = set(self.bits_of(problem.hole).tolist())
+        self.annulus_cache = {}
+
+    def bits_of(self, pts):
+        pts = pts - self.problem.hole_min
+        return self.bit_by_cell[pts[:, 0], pts[:, 1]]
+
+    def to_bitset(self, bits):
+        flags = np.zeros(self.nbytes * 8, dtype=bool)
+        flags[bits] = True
+        return int.from_bytes(np.packbits(flags, bitorder='little').tobytes(), 'little')
+
+    def from_bitset(self, bitset):
+        packed = np.frombuffer(bitset.to_bytes(self.nbytes, 'little'), dtype=np.uint8)
+        return np.flatnonzero(np.unpackbits(packed, bitorder='little'))
+
+    def annulus(self, edge_order, bit):
+        key = (int(self.problem.original_lengths[edge_order]), bit)
+        if key not in self.annulus_cache:
+            candidates = self.problem.neighbour_candidates(edge_order, self.points[bit])
+            self.annulus_cache[key] = self.to_bitset(self.bits_of(candidates))
+        return self.annulus_cache[key]
+
+    def pick_vertex(self, domains, placed):
+        best, best_key = None, None
+        for v, domain in enumerate(domains):
+            if placed[v] is not None:
+                continue
+            placed_neighbours = sum(1 for u, _ in self.adjacent[v] if placed[u] is not None)
+            key = (domain.bit_count(), -placed_neighbours, -len(self.adjacent[v]))
+            if best_key is None or key < best_key:
+                best, best_key = v, key
+        return best
+
+    def order_candidates(self, domain):
+        bits = self.from_bitset(domain)
+        self.rng.shuffle(bits)
+        corners = [b for b in bits.tolist() if b in self.corner_bits]
+        return corners + [b for b in bits.tolist() if b not in self.corner_bits]
+
+    def search(self, domains, placed, left):
+        if not left:
+            return True
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise SolveTimeout()
+
+        v = self.pick_vertex(domains, placed)
+        for bit in self.order_candidates(domains[v]):
+            pt = self.points[bit]
+            if not all(self.problem.segment_inside(pt, self.points[placed[u]])
+                       for u, _ in self.adjacent[v] if placed[u] is not None):
+                continue
+
+            new_domains = list(domains)
+            consistent = True
+            for u, edge_order in self.adjacent[v]:
+                if placed[u] is None:
+                    new_domains[u] &= self.annulus(edge_order, bit)
+                    if not new_domains[u]:
+                        consistent = False
+                        break
+            if not consistent:
+                continue
+
+            placed[v] = bit
+            if self.search(new_domains, placed, left - 1):
+                return True
+            placed[v] = None
+        return False
+
+    def solve(self, pinned=None):
+        # pinned: {vertex: bit} vertices whose domain is a single lattice point
+        if self.time_limit is not None:
+            self.deadline = time.monotonic() + self.time_limit
+        n = len(self.problem.vertices)
+        placed = [None] * n
+        domains = [self.full] * n
+        for v, bit in (pinned or {}).items():
+            domains[v] = 1 << int(bit)
+        sys.setrecursionlimit(max(sys.getrecursionlimit(), 4 * n + 100))
+        try:
+            found = self.search(domains, placed, n)
+        except SolveTimeout:
+            return None
+        if not found:
+            return None
+        return self.points[np.array(placed)]
+
+
+def solve(num_problem, time_limit=None):
+    p = problems.read_problem(num_problem)
+    return Solver(p, time_limit).solve()
+
+
 if __name__ == "__main__":
-    solve()
\ No newline at end of file
+    if len(sys.argv) < 2:
+        print("not enough args")
+        sys.exit(1)
+
+    num = int(sys.argv[1])
+    time_limit = float(sys.argv[2]) if len(sys.argv) > 2 else None
+    vertices = solve(num, time_limit)
+    if vertices is None:
+        print("no solution found")
+        sys.exit(1)
+
+    problems.save_solution(num, vertices)
+    print("dislikes: {}".format(scoring.dislikes(problems.read_problem(num), vertices)))
@@ -0,0 +1,237 @@
+import json
+import os
+import pickle
+import threading
+import traceback
+import numpy as np
+
+STATES_PATH = './states'
+STATE_VERSION = 2
+FSYNC_INTERVAL = 1.0
+COMPACT_EVERY = 512
+
+
+def state_path(num_problem):
+    return '{}/{}.state'.format(STATES_PATH, num_problem)
+
+
+def journal_path(num_problem):
+    return '{}/{}.journal'.format(STATES_PATH, num_problem)
+
+
+def write_snapshot_tmp(num_problem, positions):
+    # a durable copy of the snapshot next to the state file, for the caller to os.replace into place
+    os.makedirs(STATES_PATH, exist_ok=True)
+    tmp_path = state_path(num_problem) + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'version': STATE_VERSION, 'problem': num_problem, 'vertices': np.asarray(positions).tolist()}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    return tmp_path
+
+
+def write_snapshot(num_problem, positions):
+    os.replace(write_snapshot_tmp(num_problem, positions), state_path(num_problem))
+
+
+def read_legacy_state(filepath):
+    # pickled canvas attributes written before STATE_VERSION 2, vertex centers in screen space
+    from drawing import EntityTypes, Scale
+    with open(filepath, 'rb') as f:
+        loaddata = pickle.load(f)
+    return np.array([Scale.to_lattice(v_data['center']) for v_data in loaddata[EntityTypes.VERTEX]],
+                    dtype=np.int64).reshape(-1, 2)
+
+
+def read_snapshot(filepath, num_problem=None):
+    try:
+        with open(filepath, 'r') as f:
+            state = json.load(f)
+    except ValueError:
+        return read_legacy_state(filepath)
+    if state.get('version') != STATE_VERSION:
+        raise ValueError('unsupported state version: {}'.format(state.get('version')))
+    if num_problem is not None and state.get('problem') != num_problem:
+        raise ValueError('state belongs to problem {}'.format(state.get('problem')))
+    return np.array(state['vertices'], dtype=np.int64).reshape(-1, 2)
+
+
+def replay_journal(filepath, positions):
+    # every record holds absolute positions, so replaying it twice is harmless;
+    # a torn last line from a crash is skipped
+    if not os.path.isfile(filepath):
+        return positions
+    with open(filepath, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            for order, x, y in record:
+                if not 0 <= order < len(positions):
+                    raise ValueError('journal moves vertex {} of {}'.format(order, len(positions)))
+                positions[order] = x, y
+    return positions
+
+
+def read_state_file(filepath, num_problem=None, vertex_count=None):
+    # raises ValueError when the state does not match the given problem number or vertex count
+    journal = '{}.journal'.format(os.path.splitext(filepath)[0])
+    positions = read_snapshot(filepath, num_problem)
+    if vertex_count is not None and len(positions) != vertex_count:
+        raise ValueError('state has {} vertices, expected {}'.format(len(positions), vertex_count))
+    return replay_journal(journal, positions)
+
+
+def read_state(num_problem, vertex_count=None):
+    # lattice positions saved for the problem, or None when there is no state
+    filepath = state_path(num_problem)
+    if not os.path.isfile(filepath):
+        return None
+    return read_state_file(filepath, num_problem, vertex_count)
+
+
+def remove_state(num_problem):
+    for filepath in (state_path(num_problem), journal_path(num_problem)):
+        if os.path.exists(filepath):
+            os.remove(filepath)
+
+
+class StateJournal:
+    # moves are appended as they happen; a background thread fsyncs them and, on the first edit and
+    # every COMPACT_EVERY records, rewrites the snapshot and empties the journal. the Tk thread only
+    # ever writes journal lines, it never waits on a snapshot fsync
+    def __init__(self, num_problem, positions):
+        self.num_problem = num_problem
+        self.positions = positions
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.records = 0
+        self.compact_requested = False
+        # lines appended while the syncer writes a snapshot; they survive the journal rewrite
+        self.tail = None
+        # bumped by reset(), so a snapshot started before it is thrown away
+        self.generation = 0
+        self.closed = threading.Event()
+        # opened on the first record, so an editor session without edits writes nothing
+        self.file = None
+        self.syncer = threading.Thread(target=self.sync_loop, daemon=True)
+        self.syncer.start()
+
+    def append(self, orders, positions):
+        if self.closed.is_set():
+            return
+        record = [[int(order), int(x), int(y)] for order, (x, y) in zip(orders, positions)]
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self.lock:
+            if self.file is None:
+                self.open_journal()
+            self.file.write(line)
+            if self.tail is not None:
+                self.tail.append(line)
+            self.dirty = True
+            self.records += 1
+            if self.records >= COMPACT_EVERY:
+                self.compact_requested = True
+
+    def open_journal(self):
+        # the lock is held. records are absolute positions, so an earlier session's journal can be
+        # appended to; without a saved snapshot it would replay onto nothing and starts empty
+        append = os.path.isfile(state_path(self.num_problem))
+        os.makedirs(STATES_PATH, exist_ok=True)
+        self.file = open(journal_path(self.num_problem), 'a' if append else 'w')
+        self.records = 0
+        self.compact_requested = True
+
+    def compact(self):
+        # the lock is held and the syncer stopped; the snapshot is replaced before the journal is truncated
+        write_snapshot(self.num_problem, self.positions)
+        if self.file is None:
+            if os.path.exists(journal_path(self.num_problem)):
+                os.remove(journal_path(self.num_problem))
+            return
+        self.file.seek(0)
+        self.file.truncate()
+        self.file.flush()
+        self.records = 0
+        self.compact_requested = False
+
+    def compact_in_background(self):
+        # replaying the whole journal over a newer snapshot is harmless, so the snapshot is written
+        # unlocked from a copy, and the journal is swapped for the lines appended meanwhile
+        with self.lock:
+            if not self.compact_requested or self.file is None:
+                return
+            self.compact_requested = False
+            positions = self.positions.copy()
+            generation = self.generation
+            self.tail = []
+        try:
+            tmp_path = write_snapshot_tmp(self.num_problem, positions)
+        except BaseException:
+            with self.lock:
+                self.tail = None
+                self.compact_requested = True
+            raise
+        with self.lock:
+            tail, self.tail = self.tail, None
+            if generation != self.generation or self.file is None:
+                os.remove(tmp_path)
+                return
+            os.replace(tmp_path, state_path(self.num_problem))
+            filepath = journal_path(self.num_problem)
+            journal = open(filepath + '.tmp', 'w')
+            journal.writelines(tail)
+            journal.flush()
+            os.replace(filepath + '.tmp', filepath)
+            self.file.close()
+            self.file = journal
+            self.records = len(tail)
+            self.dirty = True
+
+    def sync(self):
+        with self.lock:
+            if not self.dirty or self.file is None or self.file.closed:
+                return
+            self.file.flush()
+            self.dirty = False
+            # a duplicate stays valid if reset() closes the journal while the fsync runs unlocked
+            fd = os.dup(self.file.fileno())
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def sync_loop(self):
+        while not self.closed.wait(FSYNC_INTERVAL):
+            try:
+                self.compact_in_background()
+                self.sync()
+            except OSError:
+                # a failed write must not stop the syncer for the rest of the session
+                traceback.print_exc()
+
+    def reset(self):
+        # drops everything saved so far; the next record starts a fresh snapshot
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            self.dirty = False
+            self.records = 0
+            self.compact_requested = False
+            self.generation += 1
+            remove_state(self.num_problem)
+
+    def close(self, compact=True):
+        # on quit the snapshot is written right away; without compaction the journal stays on disk
+        # and is replayed by the next read_state
+        if self.closed.is_set():
+            return
+        self.closed.set()
+        self.syncer.join()
+        with self.lock:
+            if compact or self.compact_requested:
+                self.compact()
+            if self.file is not None:
+                self.file.close()
@@ -0,0 +1,157 @@
+import json
+import os
+import sqlite3
+import sys
+import time
+
+STORE_PATH = './store.sqlite3'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS poses (
+    id INTEGER PRIMARY KEY,
+    problem INTEGER NOT NULL,
+    vertices TEXT NOT NULL,
+    dislikes INTEGER NOT NULL,
+    valid INTEGER NOT NULL,
+    bonuses TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS poses_problem ON poses (problem, dislikes);
+CREATE TABLE IF NOT EXISTS best (
+    problem INTEGER PRIMARY KEY,
+    pose_id INTEGER NOT NULL REFERENCES poses (id),
+    dislikes INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS submissions (
+    id INTEGER PRIMARY KEY,
+    problem INTEGER NOT NULL,
+    pose_id INTEGER REFERENCES poses (id),
+    remote_id TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS submissions_problem ON submissions (problem, id);
+'''
+
+
+class Store:
+    def __init__(self, path=STORE_PATH):
+        # one connection per process; WAL lets concurrent workers read while one writes
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def add_pose(self, problem, vertices, dislikes, valid, bonuses=(), on_best=None):
+        # returns (pose id, whether it became the best valid pose for the problem);
+        # on_best runs before commit, i.e. while this process still holds the write lock
+        vertices = [[int(x), int(y)] for x, y in vertices]
+        c = self.connection
+        c.execute('BEGIN IMMEDIATE')
+        try:
+            pose_id = c.execute(
+                'INSERT INTO poses (problem, vertices, dislikes, valid, bonuses, created) VALUES (?, ?, ?, ?, ?, ?)',
+                (problem, json.dumps(vertices), int(dislikes), int(bool(valid)), json.dumps(list(bonuses)), time.time())
+            ).lastrowid
+            improved = False
+            if valid:
+                improved = c.execute(
+                    'INSERT INTO best (problem, pose_id, dislikes) VALUES (?, ?, ?) '
+                    'ON CONFLICT (problem) DO UPDATE SET pose_id = excluded.pose_id, dislikes = excluded.dislikes '
+                    'WHERE excluded.dislikes < best.dislikes',
+                    (problem, pose_id, int(dislikes))
+                ).rowcount > 0
+            if improved and on_best is not None:
+                on_best(vertices)
+            c.execute('COMMIT')
+        except BaseException:
+            c.execute('ROLLBACK')
+            raise
+        return pose_id, improved
+
+    def pose(self, pose_id):
+        row = self.connection.execute(
+            'SELECT problem, vertices, dislikes, valid, bonuses FROM poses WHERE id = ?', (pose_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        problem, vertices, dislikes, valid, bonuses = row
+        return {'id': pose_id, 'problem': problem, 'vertices': json.loads(vertices), 'dislikes': dislikes,
+                'valid': bool(valid), 'bonuses': json.loads(bonuses)}
+
+    def best(self, problem):
+        row = self.connection.execute('SELECT pose_id FROM best WHERE problem = ?', (problem,)).fetchone()
+        if row is None:
+            return None
+        return self.pose(row[0])
+
+    def best_dislikes(self):
+        return dict(self.connection.execute('SELECT problem, dislikes FROM best'))
+
+    def add_submission(self, problem, pose_id, remote_id):
+        self.connection.execute(
+            'INSERT INTO submissions (problem, pose_id, remote_id, created) VALUES (?, ?, ?, ?)',
+            (problem, pose_id, str(remote_id), time.time())
+        )
+
+    def best_submitted(self, problem):
+        row = self.connection.execute(
+            'SELECT MIN(poses.dislikes) FROM submissions JOIN poses ON poses.id = submissions.pose_id '
+            'WHERE submissions.problem = ?', (problem,)
+        ).fetchone()
+        return row[0]
+
+    def last_submission(self, problem):
+        row = self.connection.execute(
+            'SELECT pose_id, remote_id FROM submissions WHERE problem = ? ORDER BY id DESC LIMIT 1', (problem,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {'pose_id': row[0], 'remote_id': row[1]}
+
+
+_store = None
+_store_pid = None
+
+
+def open_store():
+    # sqlite connections must not cross a fork, so every process opens its own
+    global _store, _store_pid
+    if _store is None or _store_pid != os.getpid():
+        _store = Store()
+        _store_pid = os.getpid()
+    return _store
+
+
+def import_legacy(solutions_path='./solutions', poses_ids_path='./poses_ids'):
+    import problems
+
+    store = open_store()
+    for filename in sorted(os.listdir(solutions_path)) if os.path.isdir(solutions_path) else []:
+        if not filename.endswith('.solution'):
+            continue
+        num_problem = int(filename[:-len('.solution')])
+        with open('{}/{}'.format(solutions_path, filename), 'r') as f:
+            vertices = json.load(f)['vertices']
+        pose_id, improved = problems.record_solution(num_problem, vertices, export=False)
+        print('{}: pose {}{}'.format(num_problem, pose_id, ' (best)' if improved else ''))
+
+        ids_file = '{}/{}.id'.format(poses_ids_path, num_problem)
+        if os.path.isfile(ids_file):
+            with open(ids_file, 'r') as f:
+                for remote_id in json.load(f)['ids']:
+                    store.add_submission(num_problem, None, remote_id)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("not enough args")
+        sys.exit(1)
+
+    if sys.argv[1] == 'import':
+        import_legacy()
+    elif sys.argv[1] == 'best':
+        for num_problem, dislikes in sorted(open_store().best_dislikes().items()):
+            print('{}: {}'.format(num_problem, dislikes))
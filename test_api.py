@@ -0,0 +1,102 @@
+import json
+import os
+import re
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import api
+import store
+
+
+class PosesHandler(BaseHTTPRequestHandler):
+    # mimics /api/problems/{n}/solutions; problem 2 answers without an id, problem 3 with HTML
+    def do_POST(self):
+        m = re.fullmatch(r'/api/problems/(\d+)/solutions', self.path)
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        num_problem = int(m.group(1))
+        self.server.posted.append((num_problem, body['vertices']))
+        if num_problem == 3:
+            self.reply(200, b'<html>oops</html>', 'text/html')
+        elif num_problem == 2:
+            self.reply(200, json.dumps({}).encode(), 'application/json')
+        else:
+            self.reply(200, json.dumps({'id': 'remote-{}'.format(num_problem)}).encode(), 'application/json')
+
+    def do_GET(self):
+        m = re.fullmatch(r'/api/problems/(\d+)/solutions/(.+)', self.path)
+        self.reply(200, json.dumps({'state': 'VALID', 'dislikes': 0, 'id': m.group(2)}).encode(), 'application/json')
+
+    def reply(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ClientTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        store._store = None
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), PosesHandler)
+        self.server.posted = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.client = api.Client('token', base_url='http://127.0.0.1:{}'.format(self.server.server_port),
+                                 rate=0, retries=0)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        store.open_store().close()
+        store._store = None
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_post_records_each_success(self):
+        s = store.open_store()
+        for num_problem in (1, 2, 3):
+            s.add_pose(num_problem, [[0, 0], [1, 1]], 5, True)
+
+        replies = self.client.post_solutions([1, 2, 3, 4])
+
+        self.assertEqual(replies[1], {'id': 'remote-1'})
+        self.assertIn('error', replies[2])
+        self.assertIn('error', replies[3])
+        self.assertIn('error', replies[4])
+        self.assertEqual(sorted(n for n, _ in self.server.posted), [1, 2, 3])
+        self.assertEqual(s.last_submission(1)['remote_id'], 'remote-1')
+        self.assertIsNone(s.last_submission(2))
+        self.assertIsNone(s.last_submission(3))
+
+    def test_post_skips_already_submitted(self):
+        s = store.open_store()
+        s.add_pose(1, [[0, 0], [1, 1]], 5, True)
+        self.client.post_solutions([1])
+
+        replies = self.client.post_solutions([1])
+
+        self.assertIn('skipped', replies[1])
+        self.assertEqual(len(self.server.posted), 1)
+
+    def test_check_last_submission(self):
+        s = store.open_store()
+        s.add_pose(1, [[0, 0], [1, 1]], 5, True)
+        self.client.post_solutions([1])
+
+        replies = self.client.check_solutions([1, 2])
+
+        self.assertEqual(replies[1]['id'], 'remote-1')
+        self.assertIn('error', replies[2])
+
+
+if __name__ == '__main__':
+    unittest.main()
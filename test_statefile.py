@@ -0,0 +1,111 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import statefile
+
+
+class StateJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_journal_replays_over_snapshot(self):
+        positions = np.zeros((3, 2), dtype=np.int64)
+        journal = statefile.StateJournal(5, positions)
+        positions[1] = (4, 4)
+        journal.append([1], positions[[1]])
+        positions[2] = (7, 7)
+        journal.append([2], positions[[2]])
+        journal.close(compact=False)
+
+        self.assertEqual(statefile.read_state(5, 3).tolist(), [[0, 0], [4, 4], [7, 7]])
+
+    def test_no_state_without_edits(self):
+        statefile.StateJournal(5, np.zeros((3, 2), dtype=np.int64)).close(compact=False)
+
+        self.assertIsNone(statefile.read_state(5))
+
+    def test_reset_racing_sync(self):
+        # reset() lands on the Tk thread while the syncer fsyncs outside the lock
+        positions = np.zeros((3, 2), dtype=np.int64)
+        journal = statefile.StateJournal(5, positions)
+        real_fsync = os.fsync
+
+        def fsync_during_reset(fd):
+            journal.reset()
+            real_fsync(fd)
+
+        positions[0] = (1, 1)
+        journal.append([0], positions[[0]])
+        with mock.patch.object(statefile.os, 'fsync', fsync_during_reset):
+            journal.sync()
+        positions[0] = (2, 2)
+        journal.append([0], positions[[0]])
+        journal.close(compact=False)
+
+        self.assertEqual(statefile.read_state(5, 3)[0].tolist(), [2, 2])
+
+    def test_syncer_survives_fsync_errors(self):
+        positions = np.zeros((3, 2), dtype=np.int64)
+        calls = []
+
+        def failing_fsync(fd):
+            calls.append(fd)
+            raise OSError('fsync failed')
+
+        interval = mock.patch.object(statefile, 'FSYNC_INTERVAL', 0.01)
+        interval.start()
+        self.addCleanup(interval.stop)
+        journal = statefile.StateJournal(5, positions)
+        with mock.patch.object(statefile.os, 'fsync', failing_fsync), mock.patch('traceback.print_exc'):
+            for i in range(2):
+                journal.append([0], positions[[0]])
+                deadline = time.monotonic() + 5
+                while len(calls) <= i and time.monotonic() < deadline:
+                    time.sleep(0.01)
+            alive = journal.syncer.is_alive()
+        journal.close(compact=False)
+
+        self.assertGreaterEqual(len(calls), 2)
+        self.assertTrue(alive)
+
+    def test_background_compaction_keeps_concurrent_records(self):
+        positions = np.zeros((3, 2), dtype=np.int64)
+        journal = statefile.StateJournal(5, positions)
+        positions[0] = (1, 1)
+        journal.append([0], positions[[0]])
+        write_snapshot_tmp = statefile.write_snapshot_tmp
+
+        def append_while_writing(num_problem, snapshot):
+            positions[1] = (2, 2)
+            journal.append([1], positions[[1]])
+            return write_snapshot_tmp(num_problem, snapshot)
+
+        with mock.patch.object(statefile, 'write_snapshot_tmp', append_while_writing):
+            journal.compact_in_background()
+
+        with open(statefile.journal_path(5), 'r') as f:
+            self.assertEqual(f.read(), '[[1,2,2]]\n')
+        self.assertEqual(statefile.read_snapshot(statefile.state_path(5)).tolist(), [[1, 1], [0, 0], [0, 0]])
+        journal.close(compact=False)
+        self.assertEqual(statefile.read_state(5, 3).tolist(), [[1, 1], [2, 2], [0, 0]])
+
+    def test_mismatched_state_is_rejected(self):
+        statefile.write_snapshot(5, np.zeros((3, 2), dtype=np.int64))
+
+        with self.assertRaises(ValueError):
+            statefile.read_state(5, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,17 @@
-import os.path
-from collections import defaultdict
+from collections import defaultdict, deque
+from itertools import chain
 import tkinter
 import enum
-from drawing import Coords, Delta, CanvasShape, Circle, Line, Polygon, EntityTypes, Vertex, Edge, Tags, Scale
+from drawing import Coords, Delta, CanvasShape, Circle, Line, Polygon, EntityTypes, Vertex, Tags, Scale, \
+    ScaleInfo, RedrawQueue, draw_problem
+from geometry import SpatialHash, ROTATE_CW, MIRROR_X, MIRROR_Y, transform_about
+import placement
 import problems
-import pickle
+import relax
+import statefile
+import worker
 from typing import Dict
-import copy
+import numpy as np
 
 
 class Labels(enum.IntEnum):
@@ -14,6 +19,8 @@ class Labels(enum.IntEnum):
     STATE_NAME = 2
     COORDS = 3
     EPSILON_HARD_CHECK = 4
+    AUTO_FIX = 5
+    WORKER = 6
 
 
 class Modifiers(enum.IntEnum):
@@ -47,23 +54,48 @@ State = States.DEFAULT
 Moving_Entity_Id = None
 Making_Move = False
 Epsilon_Hard_Check = False
-Epsilon = 0
+Auto_Fix = True
+
+UNDO_MEMORY_LIMIT = 64 * 1024 * 1024
+HIT_CELL_SIZE = 4
+WORKER_POLL_MS = 100
+PINNED_FILL = 'blue'
+# screen pixels around the canvas still treated as visible, so labels and edges do not pop in late
+VIEW_MARGIN_PX = 20
+ZOOM_STEP = 1.25
+PAN_STEP_PX = 100
+FIT_MARGIN_PX = 50
 
 
 class Entities:
-    def __init__(self):
+    def __init__(self, canvas: tkinter.Canvas = None):
+        self.canvas = canvas
         self.data: Dict[CanvasShape] = {}
         # fixme: is it really needed?
         self.vertex_to_edge = defaultdict(set)
         self.last_added = None
         self.ids_by_type = defaultdict(list)
         self.vertices_id_to_order = {}
-        pass
+        # lattice positions of the figure vertices, shared with every Vertex and Edge
+        self.positions = np.zeros((0, 2), dtype=np.int64)
+        # hit-testing: figure vertices by lattice cell, anything else is checked directly
+        self.vertex_index = SpatialHash(HIT_CELL_SIZE)
+        self.other_hit_ids = []
+        self.scale_info = Scale
+        self.redraw_queue = None
+        # (v1_order, v2_order) per figure edge, aligned with ids_by_type[EntityTypes.EDGE]
+        self.edge_orders = []
+        # figure shapes outside the visible region: hidden on the canvas and not re-rendered
+        self.hidden = set()
+        # vertex orders neither auto-fix nor the background solver may move
+        self.pinned = set()
 
     def add_entity(self, entity: CanvasShape):
         self.data[entity.id] = entity
+        entity.redraw_queue = self.redraw_queue
         self.last_added = entity.id
         if entity.type == EntityTypes.EDGE:
+            self.edge_orders.append((entity.v1_order, entity.v2_order))
             self.vertex_to_edge[entity.v1_id].add(entity.id)
             self.vertex_to_edge[entity.v2_id].add(entity.id)
 
@@ -77,91 +109,240 @@ class Entities:
             v2.add_vertex_id(entity.v1_id)
         elif entity.type == EntityTypes.VERTEX:
             self.vertices_id_to_order[entity.id] = len(self.ids_by_type[EntityTypes.VERTEX])
+            entity.spatial_index = self.vertex_index
+            self.vertex_index.insert(entity.order, *self.positions[entity.order])
+        else:
+            self.other_hit_ids.append(entity.id)
 
         self.ids_by_type[entity.type].append(entity.id)
 
+    def hit_test(self, p: Coords):
+        # ids of entities containing p, in creation order, touching only nearby vertices
+        vertices_ids = self.ids_by_type[EntityTypes.VERTEX]
+        x, y = self.scale_info.to_lattice_float(p)
+        reach = 0
+        if vertices_ids:
+            reach = (self.data[vertices_ids[0]].radius + 1) / self.scale_info.scale
+        hits = [vertices_ids[order] for order in self.vertex_index.query(x - reach, y - reach, x + reach, y + reach)
+                if self.data[vertices_ids[order]].coords_inside(p)]
+        hits.extend(e_id for e_id in self.other_hit_ids if self.data[e_id].coords_inside(p))
+        return sorted(hits)
+
+    def redraw_figure(self):
+        self.cull()
+        for entity_id in chain(self.ids_by_type[EntityTypes.VERTEX], self.ids_by_type[EntityTypes.EDGE]):
+            if entity_id not in self.hidden:
+                self.data[entity_id].redraw()
+
+    def canvas_size(self):
+        width, height = self.canvas.winfo_width(), self.canvas.winfo_height()
+        if width <= 1 or height <= 1:
+            # not mapped yet
+            width, height = int(self.canvas['width']), int(self.canvas['height'])
+        return width, height
+
+    def visible_rect(self):
+        width, height = self.canvas_size()
+        x0, y0 = self.scale_info.to_lattice_float(Coords(-VIEW_MARGIN_PX, -VIEW_MARGIN_PX))
+        x1, y1 = self.scale_info.to_lattice_float(Coords(width + VIEW_MARGIN_PX, height + VIEW_MARGIN_PX))
+        return x0, y0, x1, y1
+
+    def set_hidden(self, entity_id, hidden):
+        entity = self.data[entity_id]
+        state = 'hidden' if hidden else 'normal'
+        self.canvas.itemconfig(entity.id, state=state)
+        if entity.type == EntityTypes.VERTEX:
+            self.canvas.itemconfig(entity.label, state=state)
+        if hidden:
+            self.hidden.add(entity_id)
+        else:
+            self.hidden.discard(entity_id)
+            entity.redraw()
+
+    def cull(self):
+        # hides figure shapes that left the visible region, shows and re-renders the ones that entered it
+        if self.canvas is None:
+            return
+        x0, y0, x1, y1 = self.visible_rect()
+        vertices_ids = self.ids_by_type[EntityTypes.VERTEX]
+        edges_ids = self.ids_by_type[EntityTypes.EDGE]
+        x, y = self.positions[:, 0], self.positions[:, 1]
+        visible = (x >= x0) & (x <= x1) & (y >= y0) & (y <= y1)
+        flags = list(zip(vertices_ids, visible.tolist()))
+        if edges_ids:
+            ends = self.positions[np.array(self.edge_orders)]
+            lo, hi = ends.min(axis=1), ends.max(axis=1)
+            visible = (hi[:, 0] >= x0) & (lo[:, 0] <= x1) & (hi[:, 1] >= y0) & (lo[:, 1] <= y1)
+            flags.extend(zip(edges_ids, visible.tolist()))
+        for entity_id, is_visible in flags:
+            if is_visible == (entity_id in self.hidden):
+                self.set_hidden(entity_id, not is_visible)
+
+    def refresh_view(self):
+        # the view transform changed: every visible shape is stale, hidden ones wait until they show up
+        self.cull()
+        for entity_id, entity in self.data.items():
+            if entity_id not in self.hidden:
+                entity.redraw()
+
+    def zoom(self, factor, anchor: Coords):
+        self.scale_info.zoom(factor, anchor)
+        self.refresh_view()
+
+    def pan(self, dx, dy):
+        self.scale_info.pan(dx, dy)
+        self.refresh_view()
+
+    def fit_view(self, lattice_pts):
+        width, height = self.canvas_size()
+        lo, hi = np.min(lattice_pts, axis=0), np.max(lattice_pts, axis=0)
+        span = np.maximum(hi - lo, 1)
+        self.scale_info.scale = float(min((width - 2 * FIT_MARGIN_PX) / span[0],
+                                          (height - 2 * FIT_MARGIN_PX) / span[1]))
+        self.scale_info.addx = FIT_MARGIN_PX - lo[0] * self.scale_info.scale
+        self.scale_info.addy = FIT_MARGIN_PX - lo[1] * self.scale_info.scale
+        self.refresh_view()
+
+    def figure_pivot(self):
+        return np.round(self.positions.mean(axis=0)).astype(np.int64)
+
+    def translate_figure(self, dx, dy):
+        self.positions += (dx, dy)
+        self.vertex_index.rebuild(self.positions)
+        if self.canvas is None:
+            self.redraw_figure()
+            return
+        self.canvas.move(Tags.FIGURE.value, dx * self.scale_info.scale, dy * self.scale_info.scale)
+        self.cull()
+
+    def mirror_figure(self, matrix):
+        pivot = self.figure_pivot()
+        self.positions[:] = transform_about(self.positions, matrix, pivot)
+        self.vertex_index.rebuild(self.positions)
+        if self.canvas is None:
+            self.redraw_figure()
+            return
+        sx, sy = matrix[0][0], matrix[1][1]
+        screen_pivot = self.scale_info.to_screen(*pivot)
+        self.canvas.scale(Tags.FIGURE.value, screen_pivot.x, screen_pivot.y, sx, sy)
+        # labels sit at (+10, -10) from their vertex; a mirror flips that offset
+        self.canvas.move(Tags.FIGURE_LABEL.value, 20 if sx < 0 else 0, -20 if sy < 0 else 0)
+        self.cull()
+
+    def rotate_figure(self):
+        # canvas items cannot be rotated, so each shape re-renders once in the next frame
+        self.positions[:] = transform_about(self.positions, ROTATE_CW, self.figure_pivot())
+        self.vertex_index.rebuild(self.positions)
+        self.redraw_figure()
+
+    def toggle_pin(self, vertex: Vertex):
+        if vertex.order in self.pinned:
+            self.pinned.remove(vertex.order)
+            vertex.change_fill('')
+        else:
+            self.pinned.add(vertex.order)
+            vertex.change_fill(PINNED_FILL)
+
+    def place_figure(self, vertices):
+        self.positions[:] = vertices
+        self.vertex_index.rebuild(self.positions)
+        self.redraw_figure()
+
 
 class UndoHistory:
-    def __init__(self, entities: Entities):
+    # each record keeps only the vertices an operation changed: (orders, old positions, new positions)
+    def __init__(self, entities: Entities, max_bytes=UNDO_MEMORY_LIMIT):
         self.entities = entities
-        self.undodata = []
-
-    def make_snapshot(self):
-        snapshot = []
-        for e_id in self.entities.data:
-            e = self.entities.data[e_id]
-            entity_snapshot = copy.deepcopy(e.snapshot_save())
-            snapshot.append({'id': e_id, 'snapshot': entity_snapshot})
-        self.undodata.append(snapshot)
+        self.max_bytes = max_bytes
+        self.undodata = deque()
+        self.redodata = []
+        self.used_bytes = 0
+        self.operation_start = None
+        self.journal = None
+
+    def begin_operation(self, orders=None):
+        # orders: the vertices the operation is about to move, None for the whole figure
+        self.operation_start = (np.empty(0, dtype=np.int64), np.empty((0, 2), dtype=np.int64))
+        self.touch(orders)
+
+    def touch(self, orders=None):
+        # widens an open operation; a vertex keeps the position it had when first touched
+        if self.operation_start is None:
+            return
+        positions = self.entities.positions
+        known, old = self.operation_start
+        if orders is None:
+            if len(known) == len(positions):
+                return
+            orders = np.arange(len(positions))
+        orders = np.setdiff1d(np.asarray(orders, dtype=np.int64), known)
+        if len(orders):
+            self.operation_start = (np.concatenate((known, orders)), np.concatenate((old, positions[orders])))
+
+    def end_operation(self):
+        if self.operation_start is None:
+            return
+        (orders, old), self.operation_start = self.operation_start, None
+        positions = self.entities.positions
+        if len(orders) and orders.max() >= len(positions):
+            return
+        moved = (old != positions[orders]).any(axis=1)
+        if not moved.any():
+            return
+        changed, old = orders[moved], old[moved]
+        self.push(self.undodata, (changed, old, positions[changed].copy()))
+        self.redodata.clear()
+        if self.journal is not None:
+            self.journal.append(changed, positions[changed])
+        self.enforce_limit()
+
+    @staticmethod
+    def record_bytes(record):
+        return sum(part.nbytes for part in record)
+
+    def push(self, stack, record):
+        stack.append(record)
+        self.used_bytes += self.record_bytes(record)
+
+    def pop(self, stack):
+        record = stack.pop()
+        self.used_bytes -= self.record_bytes(record)
+        return record
+
+    def enforce_limit(self):
+        while self.used_bytes > self.max_bytes and self.undodata:
+            self.used_bytes -= self.record_bytes(self.undodata.popleft())
+
+    def apply(self, orders, positions):
+        vertices_ids = self.entities.ids_by_type[EntityTypes.VERTEX]
+        edges_ids = set()
+        for order, (x, y) in zip(orders, positions):
+            v = self.entities.data[vertices_ids[order]]
+            v.move_to(int(x), int(y))
+            edges_ids.update(v.edges_ids)
+        for edge_id in edges_ids:
+            self.entities.data[edge_id].redraw()
+        self.entities.cull()
+        if self.journal is not None:
+            self.journal.append(orders, positions)
 
-    # 01: {'id': 2, 'snapshot': [X: 404, Y: 479, 3]}
     def rollback(self):
         if self.undodata:
-            snapshot = self.undodata.pop()
-            for snapshot_element in snapshot:
-                e_id, entity_snapshot = snapshot_element['id'], snapshot_element['snapshot']
-                e = self.entities.data[e_id]
-                e.snapshot_load(entity_snapshot)
-
-
-def save_state(entities, filename):
-    global Epsilon
-
-    STATES_PATH = './states'
-    filepath = '{}/{}'.format(STATES_PATH, filename)
-    savedata = {EntityTypes.POLYGON: [],
-                EntityTypes.VERTEX: [],
-                EntityTypes.EDGE: [],
-                'epsilon': Epsilon}
-
-    for p_id in entities.ids_by_type[EntityTypes.POLYGON]:
-        p = entities.data[p_id]
-        savedata[EntityTypes.POLYGON].append({
-            'pts': p.pts,
-            'outline': p.outline,
-            'width': p.width,
-            'tag': p.tag,
-            'fill': p.fill
-        })
-
-    edges = set()
-    for v_id in entities.ids_by_type[EntityTypes.VERTEX]:
-        v = entities.data[v_id]
-        savedata[EntityTypes.VERTEX].append({
-            'center': v.center,
-            'radius': v.radius,
-            'outline': v.outline,
-            'width': v.width,
-            'tag': v.tag,
-            'fill': v.fill
-        })
-        for adjacent_v_order, adjacent_v_id in enumerate(v.vertices_ids):
-            v1_order = entities.vertices_id_to_order[v.id]
-            v2_order = entities.vertices_id_to_order[adjacent_v_id]
-            vs = sorted([v1_order, v2_order])
-            edge_id = v.edges_ids[adjacent_v_order]
-            edge = entities.data[edge_id]
-            edge_data = []
-            edge_data.extend(vs)
-            edge_data.append(edge.original_length)
-            edges.add(tuple(edge_data))
-
-    savedata[EntityTypes.EDGE].extend(edges)
-
-    with open(filepath, 'wb') as f:
-        pickle.dump(savedata, f)
-
-
-def remove_state(filename):
-    STATES_PATH = './states'
-    filepath = "{}/{}".format(STATES_PATH, filename)
-    if os.path.exists(filepath):
-        os.remove(filepath)
+            record = self.pop(self.undodata)
+            orders, old, _ = record
+            self.apply(orders, old)
+            self.push(self.redodata, record)
+
+    def redo(self):
+        if self.redodata:
+            record = self.pop(self.redodata)
+            orders, _, new = record
+            self.apply(orders, new)
+            self.push(self.undodata, record)
+            self.enforce_limit()
 
 
 # todo: color coding: vertex doesn't fit the hole
-# todo: rotation
-# todo: zoom?
 
 # 1st prio
 # todo: color coding: edge too short / too long
@@ -170,48 +351,16 @@ def remove_state(filename):
 # todo: bonuses graph
 
 
-def load_state(canvas, entities, filename):
-    global Epsilon
-
-    STATES_PATH = './states'
-    filepath = '{}/{}'.format(STATES_PATH, filename)
-    if not os.path.isfile(filepath):
-        return False
-
-    with open(filepath, 'rb') as f:
-        loaddata = pickle.load(f)
-
-    for p_data in loaddata[EntityTypes.POLYGON]:
-        # p = Polygon(canvas, p_data['pts'], p_data['outline'], p_data['width'],
-        #             p_data['tag'], p_data['fill'])
-        p = Polygon(canvas, **p_data)
-        p.draw()
-        entities.add_entity(p)
-
-    vertices_ids = []
-    for order, v_data in enumerate(loaddata[EntityTypes.VERTEX]):
-        v = Vertex(canvas, order=order, **v_data)
-        v.draw()
-        entities.add_entity(v)
-        vertices_ids.append(v.id)
-
-    Epsilon = loaddata['epsilon']
-
-    for pt1, pt2, orig_length in loaddata[EntityTypes.EDGE]:
-        e = Edge(canvas,
-                 entities.data[vertices_ids[pt1]].center,
-                 entities.data[vertices_ids[pt2]].center,
-                 vertices_ids[pt1],
-                 vertices_ids[pt2],
-                 epsilon=Epsilon,
-                 orig_length=orig_length,
-                 tag=Tags.FIGURE_EDGE)
-        e.draw()
-        entities.add_entity(e)
-
-        # print(orig_length)
-
-    return True
+def load_state(canvas, entities, num_problem):
+    # the problem's figure at its saved positions, or as given when nothing was saved
+    p = problems.read_problem(num_problem)
+    try:
+        vertices = statefile.read_state(num_problem, len(p.vertices))
+    except ValueError as e:
+        print('ignoring saved state: {}'.format(e))
+        vertices = None
+    draw_problem(p, canvas, entities, scale_info=entities.scale_info, vertices=vertices)
+    return p
 
 
 def make_mouse_button1_press_handler(entities: Entities, canvas: tkinter.Canvas):
@@ -244,8 +393,11 @@ def make_mouse_button1_press_handler(entities: Entities, canvas: tkinter.Canvas)
 def make_mouse_button2_press_handler(entities: Entities):
     def handler(event):
         p = Coords(event.x, event.y)
-        for entity_id, entity in entities.data.items():
-            if entity.coords_inside(p):
+        for entity_id in entities.hit_test(p):
+            entity = entities.data[entity_id]
+            if entity.type == EntityTypes.VERTEX:
+                entities.toggle_pin(entity)
+            else:
                 entity.change_fill('red')
 
     return handler
@@ -257,13 +409,22 @@ def delete_object(event):
 
 def make_mouse_motion_handler(entities: Entities, canvas: tkinter.Canvas, coords_label: tkinter.Label,
                               undo_history: UndoHistory):
-    prev_mouse_pos = None
+    # motion events are coalesced: only the latest one is processed, once per redraw frame.
+    # the pointer is converted to lattice space once per processed event
+    prev_lattice = None
+    hovered = set()
+    pending_event = None
 
-    def handler(event):
-        global State, Moving_Entity_Id, Epsilon, Making_Move
-        nonlocal prev_mouse_pos
+    def process_frame():
+        global State, Making_Move
+        nonlocal prev_lattice, hovered, pending_event
+
+        if pending_event is None:
+            return
+        event, pending_event = pending_event, None
 
         p = Coords(event.x, event.y)
+        x, y = entities.scale_info.to_lattice(p)
         mousebtn1 = False
         if event.state | Modifiers.MOUSEBTN1 == event.state:
             mousebtn1 = True
@@ -275,55 +436,48 @@ def make_mouse_motion_handler(entities: Entities, canvas: tkinter.Canvas, coords
         if State == States.DEFAULT:
             if mousebtn1:
                 if shift:
-                    if prev_mouse_pos:
+                    if prev_lattice:
                         if not Making_Move:
-                            undo_history.make_snapshot()
-                        dx = p.x - prev_mouse_pos.x
-                        dy = p.y - prev_mouse_pos.y
-                        for vertex_id in entities.ids_by_type[EntityTypes.VERTEX]:
-                            entity = entities.data[vertex_id]
-                            entity.move(Coords(entity.center.x + dx, entity.center.y + dy))
-                        for edge_id in entities.ids_by_type[EntityTypes.EDGE]:
-                            entity = entities.data[edge_id]
-                            entity.parallel_move(dx, dy)
+                            undo_history.begin_operation()
+                        else:
+                            # shift pressed in the middle of a vertex drag
+                            undo_history.touch()
+                        prev_x, prev_y = prev_lattice
+                        if (x, y) != (prev_x, prev_y):
+                            entities.translate_figure(x - prev_x, y - prev_y)
                         Making_Move = True
 
                 else:
-                    if not Moving_Entity_Id:
-                        for entity_id, entity in entities.data.items():
-                            if entity.coords_inside(p):
-                                Moving_Entity_Id = entity_id
-
                     if Moving_Entity_Id:
+                        entity = entities.data[Moving_Entity_Id]
                         if not Making_Move:
-                            undo_history.make_snapshot()
+                            undo_history.begin_operation([entity.order] if entity.type == EntityTypes.VERTEX else [])
 
-                        entity = entities.data[Moving_Entity_Id]
                         if entity.type == EntityTypes.VERTEX:
                             move_is_legal = True
 
                             if Epsilon_Hard_Check:
                                 for edge_id in entity.edges_ids:
                                     edge = entities.data[edge_id]
-                                    original_length = edge.original_length
-                                    new_length = edge.length_if_moved(p)
-                                    if abs(new_length / original_length - 1) > (Epsilon / 1_000_000):
+                                    if not edge.length_fits(edge.length_if_moved(entity.order, x, y)):
                                         move_is_legal = False
+                                        break
 
                             if move_is_legal:
+                                entity.move_to(x, y)
                                 for edge_id in entity.edges_ids:
                                     edge = entities.data[edge_id]
                                     edge.move(p)
-                                entity.move(p)
                         else:
                             entity.move(p)
                         Making_Move = True
 
-            for entity_id, entity in entities.data.items():
-                if entity.coords_inside(p):
-                    entity.change_outline('red')
-                else:
-                    entity.change_outline('black')
+            now_hovered = set(entities.hit_test(p))
+            for entity_id in hovered - now_hovered:
+                entities.data[entity_id].change_outline('black')
+            for entity_id in now_hovered - hovered:
+                entities.data[entity_id].change_outline('red')
+            hovered = now_hovered
 
         elif State == States.CREATING_LINE:
             if mousebtn1:
@@ -333,31 +487,190 @@ def make_mouse_motion_handler(entities: Entities, canvas: tkinter.Canvas, coords
             else:
                 State = States.DEFAULT
 
-        refresh_coords_label(coords_label, p)
-        prev_mouse_pos = p
+        refresh_coords_label(coords_label, p, (x, y))
+        prev_lattice = (x, y)
 
+    def handler(event):
+        global Moving_Entity_Id
+        nonlocal pending_event
+
+        # pick the drag target right away so a fast drag cannot leave it behind before the next frame
+        buttons = Modifiers.MOUSEBTN1 | Modifiers.SHIFT
+        if State == States.DEFAULT and not Moving_Entity_Id and event.state & buttons == Modifiers.MOUSEBTN1:
+            for entity_id in entities.hit_test(Coords(event.x, event.y)):
+                Moving_Entity_Id = entity_id
+
+        pending_event = event
+        if entities.redraw_queue is None:
+            process_frame()
+        else:
+            entities.redraw_queue.schedule()
+
+    if entities.redraw_queue is not None:
+        entities.redraw_queue.before_flush.append(process_frame)
     return handler
 
 
-def make_button1_release_handler(undo_history: UndoHistory):
+def make_button1_release_handler(entities: Entities, undo_history: UndoHistory, num_problem):
+    # after a vertex drag the rest of the figure relaxes around it, within the same undo step
+    relaxer = None
+
     def handler(event):
         global Moving_Entity_Id, Making_Move
-        Moving_Entity_Id = None
+        nonlocal relaxer
+        if entities.redraw_queue is not None:
+            entities.redraw_queue.flush()
         if Making_Move:
+            entity = entities.data.get(Moving_Entity_Id)
+            if Auto_Fix and entity is not None and entity.type == EntityTypes.VERTEX:
+                if relaxer is None:
+                    relaxer = relax.Relaxer(problems.read_problem(num_problem))
+                relaxed = relaxer.relax(entities.positions, pinned=entities.pinned | {entity.order})
+                if (relaxed != entities.positions).any():
+                    undo_history.touch()
+                    entities.place_figure(relaxed)
+                    if entities.redraw_queue is not None:
+                        entities.redraw_queue.flush()
+            undo_history.end_operation()
             Making_Move = False
+        Moving_Entity_Id = None
+
+    return handler
+
+
+def make_figure_transform_handler(entities: Entities, undo_history: UndoHistory, transform):
+    def handler(_):
+        undo_history.begin_operation()
+        transform()
+        undo_history.end_operation()
+
+    return handler
+
+
+def make_rigid_placement_handler(entities: Entities, undo_history: UndoHistory, num_problem):
+    # each press moves the figure to the next best rigid placement, computed on first use
+    placements = None
+    current = -1
+
+    def handler(_):
+        nonlocal placements, current
+        if placements is None:
+            placements = placement.best_rigid_placements(problems.read_problem(num_problem))
+        if not placements:
+            return
+        current = (current + 1) % len(placements)
+        undo_history.begin_operation()
+        entities.place_figure(placements[current][1])
+        undo_history.end_operation()
 
     return handler
 
 
-def make_quitter(rootwidget, entities, filename=None):
+def make_worker_handlers(entities: Entities, undo_history: UndoHistory, canvas: tkinter.Canvas,
+                         worker_label: tkinter.Label, num_problem):
+    # start / accept / cancel a background solver seeded with the pose on the canvas;
+    # its results are polled from the Tk loop, so the editor never waits on it
+    solver = None
+
+    def poll():
+        if solver is None:
+            return
+        solver.poll()
+        refresh_worker_label(worker_label, solver)
+        if not solver.done:
+            canvas.after(WORKER_POLL_MS, poll)
+
+    def start(_):
+        nonlocal solver
+        if solver is not None and not solver.done:
+            return
+        solver = worker.SolverWorker(num_problem, entities.positions, entities.pinned)
+        solver.start()
+        refresh_worker_label(worker_label, solver)
+        canvas.after(WORKER_POLL_MS, poll)
+
+    def accept(_):
+        if solver is None or solver.best is None:
+            return
+        undo_history.begin_operation()
+        entities.place_figure(solver.best[0])
+        undo_history.end_operation()
+
+    def cancel(_):
+        if solver is None or solver.done:
+            return
+        solver.cancel()
+        refresh_worker_label(worker_label, solver)
+
+    return start, accept, cancel
+
+
+def make_quitter(rootwidget, journal=None, compact=False):
     def handler(event):
-        if filename:
-            save_state(entities, filename)
+        if journal is not None:
+            journal.close(compact=compact)
         rootwidget.destroy()
 
     return handler
 
 
+def make_remove_state_handler(journal):
+    def handler(_):
+        journal.reset()
+
+    return handler
+
+
+def make_zoom_handler(entities: Entities, factor):
+    # mouse wheel zooms about the pointer, keys about the middle of the canvas
+    def handler(event):
+        if event.widget is entities.canvas:
+            anchor = Coords(event.x, event.y)
+        else:
+            width, height = entities.canvas_size()
+            anchor = Coords(width / 2, height / 2)
+        entities.zoom(factor, anchor)
+
+    return handler
+
+
+def make_wheel_handler(entities: Entities):
+    zoom_in = make_zoom_handler(entities, ZOOM_STEP)
+    zoom_out = make_zoom_handler(entities, 1 / ZOOM_STEP)
+
+    def handler(event):
+        if event.delta > 0:
+            zoom_in(event)
+        elif event.delta < 0:
+            zoom_out(event)
+
+    return handler
+
+
+def make_pan_handler(entities: Entities, dx, dy):
+    def handler(_):
+        entities.pan(dx, dy)
+
+    return handler
+
+
+def make_drag_pan_handlers(entities: Entities):
+    # middle button drags the view
+    last = None
+
+    def press(event):
+        nonlocal last
+        last = (event.x, event.y)
+
+    def motion(event):
+        nonlocal last
+        if last is not None:
+            entities.pan(event.x - last[0], event.y - last[1])
+        last = (event.x, event.y)
+
+    return press, motion
+
+
 def make_change_mode_handler(target_mode):
     def handler(_):
         global Mode
@@ -374,6 +687,14 @@ def make_change_epsilon_handler(epsilon_label):
     return handler
 
 
+def make_change_auto_fix_handler(auto_fix_label):
+    def handler(_):
+        global Auto_Fix
+        Auto_Fix = not Auto_Fix
+        refresh_auto_fix_label(auto_fix_label)
+    return handler
+
+
 def create_labels(canvas: tkinter.Canvas):
     font = ("DejaVu Sans Mono", 8)
     y = 0
@@ -393,10 +714,20 @@ def create_labels(canvas: tkinter.Canvas):
     epsilon_label = tkinter.Label(canvas, text='Eps hard: ', font=font)
     epsilon_label.place(x=0, y=y)
 
+    y += dy
+    auto_fix_label = tkinter.Label(canvas, text='Auto fix: ', font=font)
+    auto_fix_label.place(x=0, y=y)
+
+    y += dy
+    worker_label = tkinter.Label(canvas, text='worker: ', font=font)
+    worker_label.place(x=0, y=y)
+
     return {Labels.PROBLEM_NAME: problem_label,
             Labels.STATE_NAME: state_label,
             Labels.COORDS: coords_label,
-            Labels.EPSILON_HARD_CHECK: epsilon_label}
+            Labels.EPSILON_HARD_CHECK: epsilon_label,
+            Labels.AUTO_FIX: auto_fix_label,
+            Labels.WORKER: worker_label}
 
 
 def refresh_problem_label(label: tkinter.Label, num_problem):
@@ -407,16 +738,8 @@ def refresh_state_label(label: tkinter.Label, filename):
     label.configure(text='statefile: {}'.format(filename))
 
 
-def refresh_coords_label(label: tkinter.Label, coords):
-    scale = Scale.scale
-    addx = Scale.addx
-    addy = Scale.addy
-    x, y = coords.x, coords.y
-    x -= addx
-    y -= addy
-    x = round(x / scale)
-    y = round(y / scale)
-
+def refresh_coords_label(label: tkinter.Label, coords, lattice):
+    x, y = lattice
     label.configure(text='coords: {}, orig_coords: X: {}, Y: {}'.format(coords, x, y))
 
 
@@ -424,20 +747,42 @@ def refresh_epsilon_label(label: tkinter.Label, eps_hard_check):
     label.configure(text='Eps hard: {}'.format(Epsilon_Hard_Check))
 
 
-def make_save_solution_handler(entities, num_problem, scale, addx, addy):
+def refresh_auto_fix_label(label: tkinter.Label):
+    label.configure(text='Auto fix: {}'.format(Auto_Fix))
+
+
+def refresh_worker_label(label: tkinter.Label, solver=None):
+    if solver is None:
+        text = 'worker: idle'
+    else:
+        if not solver.done:
+            state = 'running'
+        elif solver.exitcode:
+            state = 'exited {}'.format(solver.exitcode)
+        else:
+            state = 'done'
+        text = 'worker: {}, best: {}'.format(state, solver.best[1] if solver.best is not None else '-')
+    label.configure(text=text)
+
+
+def pose_from_entities(entities):
+    return entities.positions.tolist()
+
+
+def make_save_solution_handler(entities, num_problem):
     def handler(_):
-        problems.save_solution(entities, num_problem, scale, addx, addy)
+        problems.save_solution(num_problem, pose_from_entities(entities))
 
     return handler
 
 
 def run_tk():
-    global Epsilon
-
     root = tkinter.Tk()
-    canvas = tkinter.Canvas(root, bg="white", height=2000, width=3000)
+    canvas = tkinter.Canvas(root, bg="white", height=1000, width=1600)
 
-    entities = Entities()
+    entities = Entities(canvas)
+    entities.scale_info = ScaleInfo(Scale.scale, Scale.addx, Scale.addy)
+    entities.redraw_queue = RedrawQueue(canvas)
     undo_history = UndoHistory(entities)
 
     num_problem = 2
@@ -446,14 +791,10 @@ def run_tk():
     # p2 = Coords(20, 20)
 
     labels = create_labels(canvas)
-    statefile = '{}.state'.format(num_problem)
-
-    if not load_state(canvas, entities, statefile):
-        p = problems.Problem(problems.read_problem_json(num_problem))
-        p.draw_problem(canvas, entities, scale=Scale.scale, addx=Scale.addx, addy=Scale.addy)
-        Epsilon = p.epsilon
-
-    undo_history.make_snapshot()
+    p = load_state(canvas, entities, num_problem)
+    entities.fit_view(p.hole)
+    journal = statefile.StateJournal(num_problem, entities.positions)
+    undo_history.journal = journal
 
     # v1 = Vertex(canvas, Coords(100, 100), 30)
     # v2 = Vertex(canvas, Coords(300, 300), 30)
@@ -466,24 +807,55 @@ def run_tk():
     #     entities.add_entity(entity)
 
     refresh_problem_label(labels[Labels.PROBLEM_NAME], num_problem)
-    refresh_state_label(labels[Labels.STATE_NAME], statefile)
+    refresh_state_label(labels[Labels.STATE_NAME], statefile.state_path(num_problem))
     refresh_epsilon_label(labels[Labels.EPSILON_HARD_CHECK], Epsilon_Hard_Check)
+    refresh_auto_fix_label(labels[Labels.AUTO_FIX])
+    refresh_worker_label(labels[Labels.WORKER])
 
     canvas.bind('<Button-1>', make_mouse_button1_press_handler(entities, canvas))
     canvas.bind('<Button-3>', make_mouse_button2_press_handler(entities))
     canvas.bind('<Motion>', make_mouse_motion_handler(entities, canvas, labels[Labels.COORDS], undo_history))
-    canvas.bind('<ButtonRelease-1>', make_button1_release_handler(undo_history))
+    canvas.bind('<ButtonRelease-1>', make_button1_release_handler(entities, undo_history, num_problem))
     canvas.bind_all('<c>', make_change_mode_handler(Modes.CREATE_CIRCLE))
     canvas.bind_all('<e>', make_change_epsilon_handler(labels[Labels.EPSILON_HARD_CHECK]))
+    canvas.bind_all('<a>', make_change_auto_fix_handler(labels[Labels.AUTO_FIX]))
+    start_worker, accept_worker, cancel_worker = make_worker_handlers(entities, undo_history, canvas,
+                                                                      labels[Labels.WORKER], num_problem)
+    canvas.bind_all('<w>', start_worker)
+    canvas.bind_all('<Return>', accept_worker)
+    canvas.bind_all('<k>', cancel_worker)
     canvas.bind_all('<l>', make_change_mode_handler(Modes.CREATE_LINE))
     canvas.bind_all('<p>', make_change_mode_handler(Modes.CREATE_POLYGON))
     canvas.bind_all('<d>', make_change_mode_handler(Modes.DEFAULT))
-    canvas.bind_all('<x>', lambda _: remove_state(statefile))
-    canvas.bind_all('<q>', make_quitter(root, entities))
+    canvas.bind_all('<x>', make_remove_state_handler(journal))
+    canvas.bind_all('<q>', make_quitter(root, journal))
     canvas.bind_all('<z>', lambda _: undo_history.rollback())
-    canvas.bind_all('<s>', make_save_solution_handler(entities, num_problem, Scale.scale, Scale.addx, Scale.addy))
-
-    canvas.bind_all('<Escape>', make_quitter(root, entities, statefile))
-
-    canvas.pack()
+    canvas.bind_all('<y>', lambda _: undo_history.redo())
+    canvas.bind_all('<r>', make_figure_transform_handler(entities, undo_history, entities.rotate_figure))
+    canvas.bind_all('<f>', make_figure_transform_handler(entities, undo_history,
+                                                         lambda: entities.mirror_figure(MIRROR_X)))
+    canvas.bind_all('<v>', make_figure_transform_handler(entities, undo_history,
+                                                         lambda: entities.mirror_figure(MIRROR_Y)))
+    canvas.bind_all('<g>', make_rigid_placement_handler(entities, undo_history, num_problem))
+    canvas.bind_all('<s>', make_save_solution_handler(entities, num_problem))
+
+    canvas.bind_all('<Escape>', make_quitter(root, journal, compact=True))
+
+    canvas.bind('<Button-4>', make_zoom_handler(entities, ZOOM_STEP))
+    canvas.bind('<Button-5>', make_zoom_handler(entities, 1 / ZOOM_STEP))
+    canvas.bind('<MouseWheel>', make_wheel_handler(entities))
+    canvas.bind_all('<plus>', make_zoom_handler(entities, ZOOM_STEP))
+    canvas.bind_all('<equal>', make_zoom_handler(entities, ZOOM_STEP))
+    canvas.bind_all('<minus>', make_zoom_handler(entities, 1 / ZOOM_STEP))
+    canvas.bind_all('<0>', lambda _: entities.fit_view(p.hole))
+    canvas.bind_all('<Left>', make_pan_handler(entities, PAN_STEP_PX, 0))
+    canvas.bind_all('<Right>', make_pan_handler(entities, -PAN_STEP_PX, 0))
+    canvas.bind_all('<Up>', make_pan_handler(entities, 0, PAN_STEP_PX))
+    canvas.bind_all('<Down>', make_pan_handler(entities, 0, -PAN_STEP_PX))
+    pan_press, pan_motion = make_drag_pan_handlers(entities)
+    canvas.bind('<Button-2>', pan_press)
+    canvas.bind('<B2-Motion>', pan_motion)
+    canvas.bind('<Configure>', lambda _: entities.cull())
+
+    canvas.pack(fill='both', expand=True)
     root.mainloop()
@@ -0,0 +1,22 @@
+import numpy as np
+
+EPSILON_DENOMINATOR = 1_000_000
+
+
+def edge_lengths(vertices, edges):
+    # vertices: (N, 2) pose or (B, N, 2) batch of poses
+    d = vertices[..., edges[:, 0], :] - vertices[..., edges[:, 1], :]
+    return (d * d).sum(axis=-1)
+
+
+def check_stretch(problem, vertices):
+    # |new / orig - 1| <= eps / 1e6  <=>  min_lengths <= new <= max_lengths, bounds precomputed per edge
+    vertices = np.asarray(vertices, dtype=np.int64)
+    lengths = edge_lengths(vertices, problem.edges)
+    violations = (lengths < problem.min_lengths) | (lengths > problem.max_lengths)
+    return violations, ~violations.any(axis=-1)
+
+
+def pose_is_valid(problem, vertices):
+    vertices = np.asarray(vertices, dtype=np.int64)
+    return bool(check_stretch(problem, vertices)[1]) and problem.pose_inside(vertices)
@@ -0,0 +1,159 @@
+import math
+import multiprocessing
+import os
+import sys
+import numpy as np
+
+VISIBILITY_PATH = './cache/visibility'
+VISIBILITY_VERSION = 1
+# displacements per work unit, a multiple of 8 so blocks pack into whole bytes
+BLOCK_COLUMNS = 512
+PARALLEL_MIN_PAIRS = 1 << 24
+
+
+def reachable_displacements(problem):
+    # canonical half (dx > 0, or dx == 0 and dy > 0) of every displacement some figure edge can take;
+    # the other half is answered by swapping the endpoints
+    tables = [problem.displacements.for_length(length) for length in np.unique(problem.original_lengths)]
+    d = np.unique(np.concatenate(tables), axis=0)
+    return d[(d[:, 0] > 0) | ((d[:, 0] == 0) & (d[:, 1] > 0))]
+
+
+def sample(mask, shape, ox, oy, step=1):
+    # r[x, y] = mask[step * x + ox, step * y + oy], False where that falls outside mask
+    result = np.zeros(shape, dtype=bool)
+    x0, y0 = max(0, (-ox + step - 1) // step), max(0, (-oy + step - 1) // step)
+    x1 = min(shape[0], (mask.shape[0] - 1 - ox) // step + 1)
+    y1 = min(shape[1], (mask.shape[1] - 1 - oy) // step + 1)
+    if x0 < x1 and y0 < y1:
+        result[x0:x1, y0:y1] = mask[step * x0 + ox:step * (x1 - 1) + ox + 1:step,
+                                    step * y0 + oy:step * (y1 - 1) + oy + 1:step]
+    return result
+
+
+def visible_block(task):
+    # packed bits (points, columns / 8): segment from every interior point p to p + d inside the hole.
+    # exact: no proper crossing with a hole edge, and the midpoint of every piece between consecutive
+    # lattice points on the segment inside the hole (doubled lattice)
+    hole, hole_mask, half_mask, displacements = task
+    width, height = shape = hole_mask.shape
+    points = np.argwhere(hole_mask)
+    edges = list(zip(hole.tolist(), np.roll(hole, -1, axis=0).tolist()))
+    xs, ys = np.arange(width)[:, None], np.arange(height)[None, :]
+    # side of every grid point relative to every hole edge, independent of the displacement
+    sides = [np.sign((bx - ax) * (ys - ay) - (by - ay) * (xs - ax)).astype(np.int8)
+             for (ax, ay), (bx, by) in edges]
+    columns = np.zeros((len(points), len(displacements)), dtype=bool)
+
+    for k, (dx, dy) in enumerate(displacements.tolist()):
+        ok = hole_mask & sample(hole_mask, shape, dx, dy)
+        g = math.gcd(dx, dy)
+        for i in range(g):
+            ok &= sample(half_mask, shape, (2 * i + 1) * dx // g, (2 * i + 1) * dy // g, step=2)
+
+        for ((ax, ay), (bx, by)), side in zip(edges, sides):
+            # only segments whose bounding box meets the edge's can cross it, and only those
+            # ending on the grid are still candidates
+            x0 = max(0, -dx, min(ax, bx) - max(dx, 0))
+            x1 = min(width, width - dx, max(ax, bx) - min(dx, 0) + 1)
+            y0 = max(0, -dy, min(ay, by) - max(dy, 0))
+            y1 = min(height, height - dy, max(ay, by) - min(dy, 0) + 1)
+            if x0 >= x1 or y0 >= y1:
+                continue
+            straddles = side[x0:x1, y0:y1] * side[x0 + dx:x1 + dx, y0 + dy:y1 + dy] < 0
+            px, py = xs[x0:x1], ys[:, y0:y1]
+            o_a = dx * (ay - py) - dy * (ax - px)
+            o_b = dx * (by - py) - dy * (bx - px)
+            ok[x0:x1, y0:y1] &= ~(straddles & (o_a * o_b < 0))
+
+        columns[:, k] = ok[points[:, 0], points[:, 1]]
+    return np.packbits(columns, axis=1, bitorder='little')
+
+
+def build_visibility(problem, displacements, processes=None):
+    index = problem.segment_index()
+    hole = problem.hole - problem.hole_min
+    hole_mask = np.asarray(problem.hole_mask)
+    tasks = [(hole, hole_mask, index.half_mask, displacements[i:i + BLOCK_COLUMNS])
+             for i in range(0, len(displacements), BLOCK_COLUMNS)]
+    if not tasks:
+        return np.zeros((int(hole_mask.sum()), 0), dtype=np.uint8)
+    if int(hole_mask.sum()) * len(displacements) < PARALLEL_MIN_PAIRS or len(tasks) == 1:
+        blocks = [visible_block(task) for task in tasks]
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            blocks = pool.map(visible_block, tasks)
+    return np.concatenate(blocks, axis=1)
+
+
+class Visibility:
+    def __init__(self, problem, displacements, bits):
+        self.origin = problem.hole_min
+        self.bit_by_cell = np.full(problem.hole_mask.shape, -1, dtype=np.int64)
+        self.bit_by_cell[np.asarray(problem.hole_mask)] = np.arange(len(bits))
+        self.reach = int(np.abs(displacements).max()) if len(displacements) else 0
+        self.column = np.full((self.reach + 1, 2 * self.reach + 1), -1, dtype=np.int64)
+        self.column[displacements[:, 0], displacements[:, 1] + self.reach] = np.arange(len(displacements))
+        self.bits = bits
+
+    def point_bit(self, x, y):
+        x, y = x - int(self.origin[0]), y - int(self.origin[1])
+        width, height = self.bit_by_cell.shape
+        if 0 <= x < width and 0 <= y < height:
+            return int(self.bit_by_cell[x, y])
+        return -1
+
+    def lookup(self, p, q):
+        # True/False for interior points some figure edge can span, None when the table has no answer
+        px, py, qx, qy = int(p[0]), int(p[1]), int(q[0]), int(q[1])
+        dx, dy = qx - px, qy - py
+        if dx < 0 or (dx == 0 and dy < 0):
+            px, py, qx, qy, dx, dy = qx, qy, px, py, -dx, -dy
+        if (dx == 0 and dy == 0) or dx > self.reach or abs(dy) > self.reach:
+            return None
+        k = int(self.column[dx, dy + self.reach])
+        i = self.point_bit(px, py)
+        if k < 0 or i < 0 or self.point_bit(qx, qy) < 0:
+            return None
+        return bool(self.bits[i, k >> 3] >> (k & 7) & 1)
+
+
+def visibility_path(problem):
+    return '{}/{}_v{}.npy'.format(VISIBILITY_PATH, problem.digest, VISIBILITY_VERSION)
+
+
+def load_visibility(problem, build=False, processes=None):
+    # the problem's table from the disk cache, built and cached first when build is set
+    if problem.digest is None:
+        return None
+    displacements = reachable_displacements(problem)
+    filepath = visibility_path(problem)
+    if os.path.isfile(filepath):
+        bits = np.load(filepath, mmap_mode='r')
+    elif build:
+        bits = build_visibility(problem, displacements, processes)
+        os.makedirs(VISIBILITY_PATH, exist_ok=True)
+        tmp_filepath = '{}.{}.tmp.npy'.format(filepath[:-len('.npy')], os.getpid())
+        np.save(tmp_filepath, bits)
+        os.replace(tmp_filepath, filepath)
+    else:
+        return None
+    if bits.shape != (int(np.asarray(problem.hole_mask).sum()), (len(displacements) + 7) // 8):
+        return None
+    return Visibility(problem, displacements, bits)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("not enough args")
+        sys.exit(1)
+
+    import problems
+    nums = problems.all_problems() if sys.argv[1] == 'all' else [int(n) for n in sys.argv[1:]]
+    for num in nums:
+        p = problems.read_problem(num)
+        table = load_visibility(p, build=True)
+        if table is None:
+            print("{}: no visibility table".format(num))
+            continue
+        print("{}: {} points x {} displacements".format(num, len(table.bits), len(reachable_displacements(p))))
@@ -0,0 +1,79 @@
+import multiprocessing
+import queue
+import time
+import numpy as np
+
+import anneal
+import problems
+
+WORKER_TIME_LIMIT = 120
+REPORT_INTERVAL = 0.25
+
+
+def stream_improvements(num_problem, start, pinned, time_limit, seed, results):
+    # runs in the worker process: puts (vertices, dislikes) on every reported best, None when finished
+    p = problems.read_problem(num_problem)
+    last_report = 0.0
+    pending = None
+
+    def on_best(vertices, dislikes):
+        nonlocal last_report, pending
+        pending = (vertices.tolist(), int(dislikes))
+        now = time.monotonic()
+        if now - last_report >= REPORT_INTERVAL:
+            results.put(pending)
+            pending = None
+            last_report = now
+
+    anneal.improve(p, np.array(start, dtype=np.int64), time_limit, seed, pinned=pinned, on_best=on_best)
+    if pending is not None:
+        results.put(pending)
+    results.put(None)
+
+
+class SolverWorker:
+    def __init__(self, num_problem, start, pinned=(), time_limit=WORKER_TIME_LIMIT, seed=0):
+        # spawn, not fork: the parent holds a Tk connection the child must not inherit
+        context = multiprocessing.get_context('spawn')
+        self.results = context.Queue()
+        self.process = context.Process(target=stream_improvements, daemon=True,
+                                       args=(num_problem, np.asarray(start).tolist(), sorted(pinned),
+                                             time_limit, seed, self.results))
+        self.best = None
+        self.done = False
+        self.exitcode = None
+
+    def start(self):
+        self.process.start()
+
+    def poll(self):
+        # drains the queue without blocking, returns True if a better pose arrived
+        improved = False
+        # checked before draining: once the child is gone, everything it sent is already readable
+        alive = self.process.is_alive()
+        while True:
+            try:
+                item = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self.done = True
+                self.process.join()
+                self.exitcode = self.process.exitcode
+                continue
+            vertices, dislikes = item
+            if self.best is None or dislikes < self.best[1]:
+                self.best = (np.array(vertices, dtype=np.int64), dislikes)
+                improved = True
+        if not alive and not self.done:
+            # the child died without its sentinel: crashed, killed or out of memory
+            self.process.join()
+            self.exitcode = self.process.exitcode
+            self.done = True
+        return improved
+
+    def cancel(self):
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join()
+        self.done = True